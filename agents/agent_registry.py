@@ -441,8 +441,8 @@ class AgentRegistry:
 
         # 修复：确保logger参数正确传递
         if logger is None:
-            from utils.logger import setup_logger
-            logger = setup_logger(f"agent_{specialty}")        
+            from utils.logger import get_agent_logger
+            logger = get_agent_logger(f"agent_{specialty}")
 
         # 使用工厂方法创建智能体
         return SpecialtyAgentFactory.create_agent(
@@ -1,11 +1,155 @@
-import json
+import asyncio
+import hashlib
 import os
-from datetime import datetime
+import random
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Any, Sequence
 from loguru import logger
-from openai import OpenAI
+from openai import (
+    APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI, RateLimitError
+)
+from utils import fastjson
+from utils.config import get_config
+from utils.timeutils import now_iso
+import httpx
+import threading
 import time
+import weakref
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+# 重试退避参数（秒）
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 60
+# 连接预热请求的超时时间（秒）
+WARM_UP_TIMEOUT = 5
+
+# 按 (引擎, base_url) 共享的客户端连接池，避免每个智能体各自建立TCP/TLS连接
+_CLIENT_POOL: Dict[tuple, OpenAI] = {}
+# 异步客户端的连接绑定在创建它的事件循环上，不能跨事件循环复用：
+# 按事件循环分别共享，事件循环被回收时随之释放
+_ASYNC_CLIENT_POOL: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+_CLIENT_POOL_LOCK = threading.Lock()
+_HTTP_LIMITS = httpx.Limits(max_connections=128, max_keepalive_connections=64, keepalive_expiry=300)
+
+# 按事件循环、再按 (引擎, base_url) 共享的并发请求上限，所有智能体的异步请求共用；
+# 以事件循环对象为弱引用键，事件循环被回收时其信号量随之释放
+_REQUEST_LIMITERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+@lru_cache(maxsize=4096)
+def _encode_role_content(role: str, content: str) -> bytes:
+    """编码单条消息（按角色和内容缓存）"""
+    return fastjson.dumps([role, content]) + b"\n"
+
+def _encode_message(message: Dict) -> bytes:
+    """编码单条消息用于计算缓存键，只含role/content的常见消息走缓存"""
+    if len(message) == 2 and isinstance(message.get("content"), str) and "role" in message:
+        return _encode_role_content(message["role"], message["content"])
+    return fastjson.dumps(message, sort_keys=True) + b"\n"
+
+# 常见病历字段 (字段名, 标签)，按输出顺序排列
+MEDICAL_RECORD_FIELDS = (
+    ('chief_complaint', '主诉'),
+    ('present_illness', '现病史'),
+    ('past_history', '既往史'),
+    ('physical_exam', '体格检查'),
+    ('lab_results', '辅助检查'),
+    ('vital_signs', '生命体征'),
+    ('diagnosis', '初步诊断'),
+)
+_MEDICAL_RECORD_FIELD_KEYS = frozenset(key for key, _ in MEDICAL_RECORD_FIELDS)
+# 自由文本病历字段，按优先级排列
+_MEDICAL_TEXT_KEYS = ('free_text', 'text', 'content')
+
+def freeze_medical_record(medical_dict: Dict) -> tuple:
+    """将病历字典转换为可哈希的 ((字段, 文本), ...)，空值字段不保留"""
+    return tuple((key, str(value)) for key, value in medical_dict.items() if value)
+
+@lru_cache(maxsize=512)
+def format_medical_record(frozen_record: tuple, fields: tuple = MEDICAL_RECORD_FIELDS,
+                          include_extra: bool = True) -> str:
+    """
+    将病历格式化为 "标签: 内容" 文本（按冻结后的病历缓存，多智能体分析同一病例时只格式化一次）
+    
+    Args:
+        frozen_record: freeze_medical_record 的结果
+        fields: 按顺序输出的 (字段名, 标签)
+        include_extra: 是否追加不在 fields 中的其他字段
+        
+    Returns:
+        str: 格式化文本，无内容时为空字符串
+    """
+    record = dict(frozen_record)
+    text_parts = [f"{label}: {record[key]}" for key, label in fields if key in record]
+    
+    # 添加其他字段
+    if include_extra:
+        if fields is MEDICAL_RECORD_FIELDS:
+            field_keys = _MEDICAL_RECORD_FIELD_KEYS
+        else:
+            field_keys = frozenset(key for key, _ in fields)
+        text_parts.extend(f"{key}: {value}" for key, value in frozen_record if key not in field_keys)
+    
+    return '\n'.join(text_parts)
+
+@lru_cache(maxsize=2)
+def _format_date(day_ordinal: int) -> str:
+    """格式化日期（按天缓存）"""
+    return date.fromordinal(day_ordinal).strftime("%Y年%m月%d日")
+
+def current_date_str() -> str:
+    """当前日期，如“2024年01月01日”，同一天内复用格式化结果"""
+    return _format_date(date.today().toordinal())
+
+_TOKEN_ENCODING = None
+
+@lru_cache(maxsize=4096)
+def _count_tokens(text: str) -> int:
+    """估算文本token数：有tiktoken时使用cl100k_base编码近似，否则按字符数估算（中文约一字一token）"""
+    global _TOKEN_ENCODING
+    if HAS_TIKTOKEN:
+        if _TOKEN_ENCODING is None:
+            _TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+        return len(_TOKEN_ENCODING.encode(text))
+    return len(text)
+
+def _count_message_tokens(message: Dict) -> int:
+    """估算单条消息token数（含角色等格式开销）"""
+    content = message.get("content")
+    return _count_tokens(content if isinstance(content, str) else str(content)) + 4
+
+async def aclose_async_clients() -> None:
+    """关闭当前事件循环中创建的异步客户端，在事件循环结束前调用以释放连接"""
+    with _CLIENT_POOL_LOCK:
+        loop_clients = _ASYNC_CLIENT_POOL.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.close()
 
 class AgentHelper:
     """智能体助手基类 - 处理LLM API调用"""
@@ -17,73 +161,234 @@ class AgentHelper:
         self.url = url
         self.api_key = os.getenv("API_KEY", "")
         self.default_temp = 0.3
+        # 默认生成长度上限：vLLM按 max_tokens 预留KV缓存，过大的值会挤占并发槽位
+        # 取模型配置中的 max_tokens（model_config.json 可覆盖），args.max_new_tokens 优先
+        self.max_new_tokens = getattr(args, 'max_new_tokens', None) or get_config().model.max_tokens
+        # 同一后端同时进行的异步请求上限（所有智能体共享），超出的请求在本地排队
+        self.max_inflight_requests = getattr(args, 'max_inflight_requests', 32)
         
-        # 初始化客户端
+        # 精确匹配响应缓存（仅缓存确定性调用，即 temperature <= 0）
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_max_size = getattr(args, 'cache_size', 1024)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # 初始化客户端，异步客户端在各事件循环中首次使用时创建
         self.client = self._initialize_client()
     
-    def _initialize_client(self) -> OpenAI:
-        """根据引擎类型初始化客户端"""
+    def _get_client_kwargs(self) -> Dict[str, Any]:
+        """根据引擎类型获取客户端参数"""
         if self.engine == "openai":
-            return OpenAI(api_key=self.api_key)
+            return {"api_key": self.api_key}
         
         elif self.engine == "deepseek":
-            return OpenAI(
-                api_key=self.api_key,
-                base_url="https://api.deepseek.com/v1",
-            )
+            return {
+                "api_key": self.api_key,
+                "base_url": "https://api.deepseek.com/v1",
+            }
         
         elif self.engine == "vllm":
             # 处理vllm后端
             base_url = self.url
             if base_url.endswith("/v1"):
                 base_url = base_url[:-3]
-            return OpenAI(
-                api_key="EMPTY",  # vllm不需要真正的API key
-                base_url=f"{base_url}/v1",
-            )
+            return {
+                "api_key": "EMPTY",  # vllm不需要真正的API key
+                "base_url": f"{base_url}/v1",
+            }
         
         elif self.engine == "siliconflow":
-            return OpenAI(
-                api_key=self.api_key,
-                base_url="https://api.siliconflow.cn/v1",
-            )
+            return {
+                "api_key": self.api_key,
+                "base_url": "https://api.siliconflow.cn/v1",
+            }
         
         else:
             raise ValueError(f"不支持的引擎类型: {self.engine}")
     
-    def invoke(self, llm_name: str, messages: List[Dict], temperature: float = None, timeout: int = 60) -> str: 
+    def _client_pool_key(self, client_kwargs: Dict[str, Any]) -> tuple:
+        """连接池键"""
+        return (self.engine, client_kwargs.get("base_url", ""))
+    
+    def _initialize_client(self) -> OpenAI:
+        """根据引擎类型获取共享客户端"""
+        client_kwargs = self._get_client_kwargs()
+        pool_key = self._client_pool_key(client_kwargs)
+        
+        with _CLIENT_POOL_LOCK:
+            client = _CLIENT_POOL.get(pool_key)
+            if client is None:
+                client = OpenAI(
+                    http_client=httpx.Client(http2=HAS_HTTP2, limits=_HTTP_LIMITS),
+                    **client_kwargs
+                )
+                _CLIENT_POOL[pool_key] = client
+        return client
+    
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """当前事件循环中共享的异步客户端（须在事件循环中访问）"""
+        loop = asyncio.get_running_loop()
+        client_kwargs = self._get_client_kwargs()
+        pool_key = self._client_pool_key(client_kwargs)
+        
+        with _CLIENT_POOL_LOCK:
+            loop_clients = _ASYNC_CLIENT_POOL.get(loop)
+            if loop_clients is None:
+                loop_clients = _ASYNC_CLIENT_POOL[loop] = {}
+            client = loop_clients.get(pool_key)
+            if client is None:
+                client = loop_clients[pool_key] = AsyncOpenAI(
+                    http_client=httpx.AsyncClient(http2=HAS_HTTP2, limits=_HTTP_LIMITS),
+                    **client_kwargs
+                )
+        return client
+    
+    def warm_up_connections(self, count: int = 4) -> int:
+        """
+        预热连接池，并发请求模型列表以提前完成TCP/TLS握手（HTTP/1.1下每个并发请求各建立一个连接）
+        
+        Args:
+            count: 预热请求数
+            
+        Returns:
+            int: 成功的预热请求数
+        """
+        # 预热失败不影响后续请求，不重试，也不因后端不可用而长时间阻塞
+        client = self.client.with_options(timeout=WARM_UP_TIMEOUT, max_retries=0)
+        
+        def _list_models(_) -> bool:
+            try:
+                client.models.list()
+                return True
+            except Exception as e:
+                self.logger.warning(f"连接预热失败: {e}")
+                return False
+        
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            return sum(executor.map(_list_models, range(count)))
+    
+    def _make_cache_key(self, llm_name: str, messages: List[Dict], temperature: float) -> str:
+        """根据模型、消息和温度生成缓存键，逐条复用已编码的消息，避免每次序列化整个对话"""
+        digest = hashlib.sha256(f"{llm_name}\x00{temperature}\x00".encode('utf-8'))
+        for message in messages:
+            digest.update(_encode_message(message))
+        return digest.hexdigest()
+    
+    def _lookup_cache(self, llm_name: str, messages: List[Dict], temperature: float):
+        """
+        查询精确匹配缓存
+        
+        Returns:
+            (缓存键, 缓存内容)，非确定性调用的缓存键为None
+        """
+        if temperature > 0:
+            return None, None
+        
+        cache_key = self._make_cache_key(llm_name, messages, temperature)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+        return cache_key, cached
+    
+    def _store_cache(self, cache_key: str, content: str) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self._cache[cache_key] = content
+        self._cache.move_to_end(cache_key)
+        if len(self._cache) > self._cache_max_size:
+            self._cache.popitem(last=False)
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """获取缓存命中统计"""
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self._cache)
+        }
+    
+    @staticmethod
+    def _get_retry_delay(error: Exception, attempt: int) -> Optional[float]:
+        """
+        计算重试等待时间
+        
+        只重试连接错误、超时、限流、5xx和空响应；其他4xx等不可恢复的错误返回None，立即失败
+        """
+        if isinstance(error, RateLimitError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), RETRY_MAX_DELAY)
+            except (TypeError, ValueError):
+                pass
+        elif isinstance(error, APIStatusError):
+            if error.status_code < 500 and error.status_code != 408:
+                return None
+        elif not isinstance(error, (APIConnectionError, ValueError)):
+            return None
+        
+        # 指数退避加随机抖动，避免并发请求同时重试
+        return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + random.uniform(0, RETRY_BASE_DELAY)
+    
+    def _build_request_kwargs(self, llm_name: str, messages: List[Dict], temperature: float,
+                              timeout: int, max_tokens: int = None) -> Dict[str, Any]:
+        """构建聊天补全请求参数"""
+        return {
+            "model": llm_name,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens or self.max_new_tokens,
+            "timeout": timeout
+        }
+    
+    def invoke(self, llm_name: str, messages: List[Dict], temperature: float = None, timeout: int = 60,
+               max_tokens: int = None) -> str: 
         """调用LLM API"""
         if temperature is None:
             temperature = self.default_temp
         
+        # 确定性调用先查缓存，命中则跳过网络请求
+        cache_key, cached = self._lookup_cache(llm_name, messages, temperature)
+        if cached is not None:
+            return cached
+        
         max_retries = 3
-        retry_delay = 10
+        request_kwargs = self._build_request_kwargs(llm_name, messages, temperature, timeout, max_tokens)
         
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=llm_name,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=100000,
-                    timeout=timeout
-                )
+                response = self.client.chat.completions.create(**request_kwargs)
                 
                 content = response.choices[0].message.content
                 if content:
+                    if cache_key is not None:
+                        self._store_cache(cache_key, content)
                     return content
                 else:
                     raise ValueError("Empty response from model")
                     
             except Exception as e:
                 self.logger.warning(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                else:
+                delay = self._get_retry_delay(e, attempt) if attempt < max_retries - 1 else None
+                if delay is None:
                     raise Exception(f"API调用失败: {e}")
+                time.sleep(delay)
         
         raise Exception("无法获取模型响应")
-
+    
+    def _request_limiter(self) -> asyncio.Semaphore:
+        """获取当前事件循环中本后端共享的并发请求信号量"""
+        loop = asyncio.get_running_loop()
+        loop_limiters = _REQUEST_LIMITERS.get(loop)
+        if loop_limiters is None:
+            loop_limiters = _REQUEST_LIMITERS[loop] = {}
+        limiter_key = (self.engine, self.url)
+        limiter = loop_limiters.get(limiter_key)
+        if limiter is None:
+            limiter = loop_limiters[limiter_key] = asyncio.Semaphore(self.max_inflight_requests)
+        return limiter
+    
 class BaseAgent(AgentHelper):
     """基础智能体类 - 所有智能体的基类"""
     
@@ -104,9 +409,11 @@ class BaseAgent(AgentHelper):
         self.system_instruction = system_instruction
         self.agent_name = agent_name
 
-        if logger is None:
-            from utils.logger import setup_logger
-            self.logger = setup_logger(f"agent_{agent_name}")
+        # logger 可以是日志记录器，也可以是收集日志条目的列表（此时另取智能体日志记录器）
+        self._log_entries = logger if isinstance(logger, list) else None
+        if logger is None or self._log_entries is not None:
+            from utils.logger import get_agent_logger
+            self.logger = get_agent_logger(f"agent_{agent_name}")
         else:
             self.logger = logger
         
@@ -117,10 +424,23 @@ class BaseAgent(AgentHelper):
             url=getattr(args, 'url', "http://10.124.0.7:9001/v1")
         )
         
-        # 初始化消息历史
-        self.messages = [{"role": "system", "content": system_instruction}]
+        # 语义缓存（可选，通过 args.semantic_cache 开启）
+        self.semantic_cache = None
+        if getattr(args, 'semantic_cache', False):
+            from utils.semantic_cache import get_semantic_cache
+            self.semantic_cache = get_semantic_cache(getattr(args, 'sem_threshold', 0.92))
+        
+        # 上下文窗口（token数），设置后 chat 会在请求前截断过早的对话
+        self.ctx_limit = getattr(args, 'ctx_limit', None)
+        
+        # 默认系统消息只创建一次，各次调用共享（初始化后视为不可变）
+        self._system_message = {"role": "system", "content": system_instruction}
+        
+        # 初始化消息历史：messages 为发送给模型的消息列表（每轮会被共享历史整体替换），
+        # with_history 只追加、完整记录每次对话（与 messages 共用消息字典，不复制内容）
+        self.messages = [self._system_message]
         self.history = {
-            "with_history": self.messages.copy(),
+            "with_history": [self._system_message],
             "without_history": []
         }
         
@@ -132,22 +452,19 @@ class BaseAgent(AgentHelper):
         
         self.logger.info(f"初始化智能体: {agent_name} ({specialty})")
     
-    def chat(self, message: str, temperature: float = None, timeout: int = 60) -> str:
+    def chat(self, message: str, temperature: float = None, timeout: int = 60,
+             max_tokens: int = None) -> str:
         """有历史记录的对话"""
         if temperature is None:
             temperature = self.args.temp
         
-        self.messages.append({"role": "user", "content": message})
+        user_message = {"role": "user", "content": message}
+        self.messages.append(user_message)
         
         try:
-            response = self.invoke(self.args.llm_name, self.messages, temperature, timeout)
-            self.messages.append({"role": "assistant", "content": response})
-            
-            # 记录历史
-            self.history['with_history'].extend([
-                {"role": "user", "content": message},
-                {"role": "assistant", "content": response}
-            ])
+            request_messages = self._fit_context_window(self.messages, max_tokens)
+            response = self.invoke(self.args.llm_name, request_messages, temperature, timeout, max_tokens)
+            self._record_with_history(user_message, response)
             
             return response
             
@@ -155,26 +472,151 @@ class BaseAgent(AgentHelper):
             self.logger.error(f"智能体 {self.agent_name} 对话失败: {e}")
             raise
     
+    async def astream_chat(self, message: str, temperature: float = None, timeout: int = 60,
+                           max_tokens: int = None) -> AsyncIterator[str]:
+        """
+        有历史记录的流式对话（异步版本），逐段产出生成内容
+        
+        调用方提前停止迭代并关闭生成器时即中止服务端生成，已生成的部分作为回复记入历史。
+        收到首段内容之前失败时按退避策略重试（与 invoke 相同）；已产出内容后失败不再重试。
+        流式请求不读写响应缓存。
+        """
+        if temperature is None:
+            temperature = self.args.temp
+        
+        user_message = {"role": "user", "content": message}
+        self.messages.append(user_message)
+        
+        request_messages = self._fit_context_window(self.messages, max_tokens)
+        request_kwargs = self._build_request_kwargs(
+            self.args.llm_name, request_messages, temperature, timeout, max_tokens
+        )
+        request_kwargs["stream"] = True
+        
+        max_retries = 3
+        chunks = []
+        try:
+            for attempt in range(max_retries):
+                try:
+                    async with self._request_limiter():
+                        stream = await self.async_client.chat.completions.create(**request_kwargs)
+                        try:
+                            async for chunk in stream:
+                                if not chunk.choices:
+                                    continue
+                                delta = chunk.choices[0].delta.content
+                                if delta:
+                                    chunks.append(delta)
+                                    yield delta
+                        finally:
+                            # 关闭连接即中止服务端生成
+                            await stream.close()
+                    
+                    if not chunks:
+                        raise ValueError("Empty response from model")
+                    return
+                    
+                except Exception as e:
+                    # 调用方已收到部分内容，重试会产出重复内容
+                    if chunks:
+                        raise
+                    self.logger.warning(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
+                    delay = self._get_retry_delay(e, attempt) if attempt < max_retries - 1 else None
+                    if delay is None:
+                        raise Exception(f"API调用失败: {e}")
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self.logger.error(f"智能体 {self.agent_name} 流式对话失败: {e}")
+            raise
+        finally:
+            if chunks:
+                self._record_with_history(user_message, "".join(chunks))
+    
+    def _record_with_history(self, user_message: Dict, response: str) -> None:
+        """将回复追加到当前消息列表，并把本轮问答追加到完整对话记录"""
+        assistant_message = {"role": "assistant", "content": response}
+        self.messages.append(assistant_message)
+        self.history['with_history'].extend((user_message, assistant_message))
+    
+    def _fit_context_window(self, messages: List[Dict], max_tokens: int = None) -> List[Dict]:
+        """
+        按上下文窗口截断请求消息
+        
+        保留系统消息和最近的对话，从最早的对话开始丢弃，直到 提示词 + max_tokens 不超过 args.ctx_limit。
+        只截断本次请求，完整对话仍保留在 self.messages / history 中。未设置 ctx_limit 时不截断。
+        """
+        if not self.ctx_limit:
+            return messages
+        
+        budget = self.ctx_limit - (max_tokens or self.max_new_tokens)
+        total = sum(_count_message_tokens(message) for message in messages)
+        if total <= budget:
+            return messages
+        
+        head = 1 if messages and messages[0]["role"] == "system" else 0
+        start = head
+        # 至少保留最后一条消息（当前提问）
+        while total > budget and start < len(messages) - 1:
+            total -= _count_message_tokens(messages[start])
+            start += 1
+        # 截断后从用户消息开始，避免以孤立的助手回复开头
+        while start < len(messages) - 1 and messages[start]["role"] == "assistant":
+            start += 1
+        
+        self.logger.warning(
+            f"智能体 {self.agent_name} 对话超出上下文窗口，本次请求丢弃最早的 {start - head} 条消息"
+        )
+        return messages[:head] + messages[start:]
+    
+    def _semantic_cache_namespace(self, system_content: str, temperature: float) -> Optional[str]:
+        """语义缓存命名空间，按模型和系统提示词隔离；非确定性调用不使用语义缓存"""
+        if self.semantic_cache is None or temperature > 0:
+            return None
+        return hashlib.sha256(
+            f"{self.args.llm_name}\n{system_content}".encode('utf-8')
+        ).hexdigest()
+    
+    def _build_messages_without_history(self, message: str, system_instruction: str = None) -> List[Dict]:
+        """构建无历史对话的消息列表，未指定系统提示词时复用默认系统消息"""
+        if system_instruction:
+            system_message = {"role": "system", "content": system_instruction}
+        else:
+            system_message = self._system_message
+        return [system_message, {"role": "user", "content": message}]
+    
+    def _record_without_history(self, messages: List[Dict], response: str) -> None:
+        """记录无历史对话（messages 为本次调用新建的列表，直接追加回复，不再复制）"""
+        messages.append({"role": "assistant", "content": response})
+        self.history['without_history'].append({
+            "messages": messages,
+            "timestamp": self._get_timestamp()
+        })
+    
     def chat_without_history(self, message: str, system_instruction: str = None, 
-                            temperature: float = None, timeout: int = 60) -> str:
+                            temperature: float = None, timeout: int = 60,
+                            max_tokens: int = None) -> str:
         """无历史记录的对话"""
         if temperature is None:
             temperature = self.args.temp
         
-        system_content = system_instruction or self.system_instruction
-        messages = [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": message}
-        ]
+        messages = self._build_messages_without_history(message, system_instruction)
+        system_content = messages[0]["content"]
+        
+        # 确定性调用可复用语义相近提示词的响应
+        cache_namespace = self._semantic_cache_namespace(system_content, temperature)
         
         try:
-            response = self.invoke(self.args.llm_name, messages, temperature, timeout)
+            response = None
+            if cache_namespace is not None:
+                response = self.semantic_cache.get(message, namespace=cache_namespace)
+            
+            if response is None:
+                response = self.invoke(self.args.llm_name, messages, temperature, timeout, max_tokens)
+                if cache_namespace is not None:
+                    self.semantic_cache.put(message, response, namespace=cache_namespace)
             
             # 记录历史
-            self.history['without_history'].append({
-                "messages": messages + [{"role": "assistant", "content": response}],
-                "timestamp": self._get_timestamp()
-            })
+            self._record_without_history(messages, response)
             
             return response
             
@@ -192,25 +634,57 @@ class BaseAgent(AgentHelper):
             "info": info,
             "answer": answer
         }
-        self.logger.append(log_entry)
+        self._emit_log(log_entry)
+    
+    def _emit_log(self, log_entry: Dict[str, Any]) -> None:
+        """记录日志条目：传入的是列表时追加到列表，否则写入日志记录器"""
+        if self._log_entries is not None:
+            self._log_entries.append(log_entry)
+        else:
+            self.logger.info(log_entry)
     
     def _get_timestamp(self) -> str:
-        """获取当前时间戳"""
-        return datetime.now().isoformat()
+        """获取当前时间戳（精确到秒，同一秒内复用格式化结果）"""
+        return now_iso()
     
     def save_conversation(self, filepath: str = None) -> None:
-        """保存对话历史"""
+        """
+        保存对话历史
+        
+        格式由 args.log_format 决定：json（默认）或 msgpack（体积更小、编码更快，需安装msgpack）
+        """
+        log_format = getattr(self.args, 'log_format', 'json')
+        if log_format == 'msgpack' and not HAS_MSGPACK:
+            logger.warning("msgpack 未安装，对话历史改用JSON格式保存")
+            log_format = 'json'
+        
         if filepath is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filepath = f"logs/{self.agent_name}_{timestamp}.json"
+            extension = "mpk" if log_format == 'msgpack' else "json"
+            filepath = f"logs/{self.agent_name}_{timestamp}.{extension}"
         
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.history, f, ensure_ascii=False, indent=2)
+        with open(filepath, 'wb') as f:
+            if log_format == 'msgpack':
+                f.write(msgpack.packb(self.history, use_bin_type=True))
+            else:
+                f.write(fastjson.dumps(self.history, indent=True))
         
         logger.info(f"对话历史已保存: {filepath}")
     
+    @staticmethod
+    def load_conversation(filepath: str) -> Dict[str, Any]:
+        """读取对话历史，按扩展名识别JSON或MessagePack格式"""
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        
+        if filepath.endswith('.mpk'):
+            if not HAS_MSGPACK:
+                raise ImportError("读取MessagePack格式的对话历史需要安装msgpack")
+            return msgpack.unpackb(data, raw=False)
+        return fastjson.loads(data)
+    
     def get_agent_info(self) -> Dict[str, Any]:
         """获取智能体信息"""
         return {
@@ -221,20 +695,22 @@ class BaseAgent(AgentHelper):
             "message_count": len(self.messages) - 1,  # 减去系统消息
             "answer_count": len(self.ans_list)
         }
-    def set_shared_history(self, shared_messages: List[Dict]) -> None:
-        """设置共享历史记录"""
-        # 保留系统消息，添加共享历史
-        system_message = self.messages[0] if self.messages and self.messages[0]["role"] == "system" else None
-        if system_message:
-            self.messages = [system_message] + shared_messages.copy()
+    def set_shared_history(self, shared_messages: Iterable[Dict]) -> None:
+        """设置共享历史记录（消息字典在智能体之间共享而不复制，调用方不应再修改）"""
+        # 保留系统消息，添加共享历史（只替换发送给模型的消息列表，history['with_history'] 不受影响）
+        if self.messages and self.messages[0]["role"] == "system":
+            self.messages[1:] = shared_messages
         else:
-            self.messages = shared_messages.copy()
+            self.messages[:] = shared_messages
     
-    def get_current_messages(self) -> List[Dict]:
-        """获取当前消息历史（不包括系统消息）"""
-        if self.messages and self.messages[0]["role"] == "system":
-            return self.messages[1:]
-        return self.messages.copy()
+    def get_current_messages(self) -> Iterator[Dict]:
+        """获取当前消息历史（不包括系统消息）的只读视图，不复制列表"""
+        start = 1 if self.messages and self.messages[0]["role"] == "system" else 0
+        return islice(self.messages, start, None)
+    
+    def get_current_messages_snapshot(self) -> List[Dict]:
+        """获取当前消息历史（不包括系统消息）的列表副本，供需要修改或长期持有的调用方使用"""
+        return list(self.get_current_messages())
     
     def add_to_shared_history(self, role: str, content: str) -> None:
         """添加消息到共享历史"""
@@ -246,44 +722,19 @@ class BaseAgent(AgentHelper):
             return medical_record
         
         if isinstance(medical_record, dict):
-            # 优先使用自由文本字段
-            if 'free_text' in medical_record:
-                return medical_record['free_text']
-            elif 'text' in medical_record:
-                return medical_record['text']
-            elif 'content' in medical_record:
-                return medical_record['content']
-            else:
-                # 将字典内容拼接成文本
-                return self._dict_to_text(medical_record)
+            # 优先使用非空的自由文本字段
+            for key in _MEDICAL_TEXT_KEYS:
+                text = medical_record.get(key)
+                if text:
+                    return text
+            # 将字典内容拼接成文本
+            return self._dict_to_text(medical_record)
         
         return str(medical_record)
     
     def _dict_to_text(self, medical_dict: Dict) -> str:
         """将病历字典转换为文本 - 简洁格式"""
-        text_parts = []
-        
-        # 按常见病历字段顺序组织
-        common_fields = [
-            ('chief_complaint', '主诉'),
-            ('present_illaint', '现病史'),
-            ('past_history', '既往史'),
-            ('physical_exam', '体格检查'),
-            ('lab_results', '辅助检查'),
-            ('vital_signs', '生命体征'),
-            ('diagnosis', '初步诊断')
-        ]
-        
-        for field_key, field_name in common_fields:
-            if field_key in medical_dict and medical_dict[field_key]:
-                text_parts.append(f"{field_name}: {medical_dict[field_key]}")
-        
-        # 添加其他字段
-        for key, value in medical_dict.items():
-            if key not in [f[0] for f in common_fields] and value:
-                text_parts.append(f"{key}: {value}")
-        
-        return '\n'.join(text_parts) if text_parts else "无病历信息"
+        return format_medical_record(freeze_medical_record(medical_dict)) or "无病历信息"
 
     def update_context(self, new_information: str, information_type: str = "general") -> None:
         """
@@ -350,29 +801,40 @@ class BaseAgent(AgentHelper):
 
 
 # 工具函数
+# 按标签缓存的答案解析正则，每个标签只编译一次
+_PATTERNS_CACHE: Dict[str, List[re.Pattern]] = {}
+
+def _get_answer_patterns(tag: str) -> List[re.Pattern]:
+    """获取指定标签的已编译答案匹配模式"""
+    patterns = _PATTERNS_CACHE.get(tag)
+    if patterns is None:
+        # 多种格式匹配
+        patterns = [
+            re.compile(pattern, re.IGNORECASE) for pattern in (
+                rf"<{tag}>Answer:\s*([A-E])</{tag}>",
+                rf"<{tag}>Answer:\s*([A-E])",
+                rf"<{tag}>Option:\s*([A-E])</{tag}>",
+                rf"Answer:\s*([A-E])",
+                rf"Option:\s*([A-E])",
+                rf"<{tag}>([A-E])</{tag}>"
+            )
+        ]
+        _PATTERNS_CACHE[tag] = patterns
+    return patterns
+
+_OPTION_LETTERS = ("A", "B", "C", "D", "E")
+
 def parse_content(content: str, tag: str = "Answer") -> str:
     """从内容中解析答案标签"""
-    import re
-    
-    # 多种格式匹配
-    patterns = [
-        rf"<{tag}>Answer:\s*([A-E])</{tag}>",
-        rf"<{tag}>Answer:\s*([A-E])",
-        rf"<{tag}>Option:\s*([A-E])</{tag}>",
-        rf"Answer:\s*([A-E])",
-        rf"Option:\s*([A-E])",
-        rf"<{tag}>([A-E])</{tag}>"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, content, re.IGNORECASE)
+    for pattern in _get_answer_patterns(tag):
+        match = pattern.search(content)
         if match:
             return match.group(1).upper()
     
     # 如果没有找到格式化的答案，尝试查找字母
-    for option in ["A", "B", "C", "D", "E"]:
-        if option in content:
-            return option
+    option = find_answer(content)
+    if option:
+        return option
     
     raise ValueError(f"无法从内容中解析答案标签 <{tag}>")
 
@@ -380,9 +842,6 @@ def check_answer_same(ans_list: List[str]) -> bool:
     """检查答案列表是否一致"""
     return len(set(ans_list)) == 1
 
-def find_answer(text: str, options: List[str] = ["A", "B", "C", "D", "E"]) -> str:
-    """从文本中查找答案"""
-    for option in options:
-        if option in text:
-            return option
-    return ""
\ No newline at end of file
+def find_answer(text: str, options: Sequence[str] = _OPTION_LETTERS) -> str:
+    """从文本中查找答案（按选项顺序返回第一个出现在文本中的选项）"""
+    return next((option for option in options if option in text), "")
\ No newline at end of file
@@ -1,14 +1,42 @@
+import re
 from typing import Dict, List, Optional, Any
 from loguru import logger
-from agents.base_agent import BaseAgent
+from agents.base_agent import (
+    BaseAgent, MEDICAL_RECORD_FIELDS, format_medical_record, freeze_medical_record
+)
 from agents.agent_registry import get_agent_registry
 
+# 响应分段关键词（中文关键词无大小写之分，无需 lower()）
+_DIAGNOSIS_PATTERN = re.compile('诊断|考虑|可能')
+_TREATMENT_PATTERN = re.compile('治疗|用药|手术')
+_REASONING_PATTERN = re.compile('因为|由于|理由')
+
+# 自定义智能体系统提示词的公共前缀，所有实例共享同一字符串对象
+_CUSTOM_PROMPT_PREFIX = """你是一位专业的医学智能体。
+
+请遵循以下原则：
+1. 基于提供的医学知识进行分析
+2. 保持专业和准确的表达
+3. 考虑临床实际情况
+4. 提供有建设性的建议
+
+请用清晰、专业的语言进行回答。
+
+"""
+
+
 class CustomAgent(BaseAgent):
     """
     自定义智能体类
     支持用户自定义提示词和行为的临时智能体
     """
     
+    # 结构化病例分析较短，限制生成长度以减少vLLM预留的KV缓存
+    ANALYSIS_MAX_TOKENS = 1024
+    
+    # 自定义分析只使用主诉到辅助检查这几个病历字段
+    _RECORD_FIELDS = MEDICAL_RECORD_FIELDS[:5]
+    
     def __init__(self, args, agent_name: str, custom_prompt: str, 
                  description: str = "", category: str = "自定义",
                  logger: list = None, session_id: str = None):
@@ -46,21 +74,13 @@ class CustomAgent(BaseAgent):
         if session_id:
             self._register_agent()
         
-        logger.info(f"Initialized custom agent: {agent_name}")
+        self.logger.info(f"Initialized custom agent: {agent_name}")
     
     def _build_custom_prompt(self, base_prompt: str) -> str:
-        """构建自定义提示词"""
-        custom_prompt = f"""你是一位专业的医学智能体。{base_prompt}
-
-请遵循以下原则：
-1. 基于提供的医学知识进行分析
-2. 保持专业和准确的表达
-3. 考虑临床实际情况
-4. 提供有建设性的建议
-
-请用清晰、专业的语言进行回答。"""
-        
-        return custom_prompt
+        """构建自定义提示词 - 固定文本在前，保证各智能体的提示词前缀字节一致以命中前缀缓存"""
+        # vLLM的自动前缀缓存在服务端按完整KV块匹配相同的前导token，无需请求参数（V1引擎默认开启）；
+        # 用户提示词放在最后，各自定义智能体的系统提示词才共享同一前缀，公共部分只需计算一次
+        return _CUSTOM_PROMPT_PREFIX + base_prompt
     
     def _register_agent(self) -> bool:
         """将自定义智能体注册到注册表"""
@@ -98,7 +118,7 @@ class CustomAgent(BaseAgent):
         message = self._build_custom_analysis_message(medical_record, specific_question)
         
         try:
-            response = self.chat_without_history(message)
+            response = self.chat_without_history(message, max_tokens=self.ANALYSIS_MAX_TOKENS)
             
             return {
                 "success": True,
@@ -133,20 +153,9 @@ class CustomAgent(BaseAgent):
     
     def _format_medical_record_for_custom_analysis(self, medical_record: Dict) -> str:
         """格式化病历信息用于自定义分析"""
-        formatted = []
-        
-        if medical_record.get('chief_complaint'):
-            formatted.append(f"主诉: {medical_record['chief_complaint']}")
-        if medical_record.get('present_illness'):
-            formatted.append(f"现病史: {medical_record['present_illness']}")
-        if medical_record.get('past_history'):
-            formatted.append(f"既往史: {medical_record['past_history']}")
-        if medical_record.get('physical_exam'):
-            formatted.append(f"体格检查: {medical_record['physical_exam']}")
-        if medical_record.get('lab_results'):
-            formatted.append(f"辅助检查: {medical_record['lab_results']}")
-        
-        return '\n'.join(formatted)
+        return format_medical_record(
+            freeze_medical_record(medical_record), self._RECORD_FIELDS, include_extra=False
+        )
     
     def _structure_custom_response(self, response: str) -> Dict[str, Any]:
         """结构化自定义响应"""
@@ -161,13 +170,13 @@ class CustomAgent(BaseAgent):
         
         current_section = other_section
         for line in lines:
-            if any(keyword in line.lower() for keyword in ['诊断', '考虑', '可能']):
+            if _DIAGNOSIS_PATTERN.search(line):
                 current_section = diagnosis_section
-            elif any(keyword in line.lower() for keyword in ['治疗', '用药', '手术']):
+            elif _TREATMENT_PATTERN.search(line):
                 current_section = treatment_section
-            elif any(keyword in line.lower() for keyword in ['因为', '由于', '理由']):
+            elif _REASONING_PATTERN.search(line):
                 current_section = reasoning_section
-            elif line.startswith(('#', '##', '###')):  # Markdown标题
+            elif line.startswith('#'):  # Markdown标题（'##'、'###' 同样以 '#' 开头）
                 current_section = other_section
             
             current_section.append(line)
@@ -193,7 +202,7 @@ class CustomAgent(BaseAgent):
         message = self._build_user_response_message(user_question, context)
         
         try:
-            response = self.chat_without_history(message)
+            response = self.chat_without_history(message, max_tokens=self.ANALYSIS_MAX_TOKENS)
             
             return {
                 "success": True,
@@ -245,7 +254,7 @@ class CustomAgent(BaseAgent):
 请提供深入、专业的分析。"""
         
         try:
-            response = self.chat_without_history(message)
+            response = self.chat_without_history(message, max_tokens=self.ANALYSIS_MAX_TOKENS)
             
             return {
                 "success": True,
@@ -290,7 +299,7 @@ class CustomAgent(BaseAgent):
 请从专业角度评估该意见的合理性、优点和局限性。"""
         
         try:
-            response = self.chat_without_history(message)
+            response = self.chat_without_history(message, max_tokens=self.ANALYSIS_MAX_TOKENS)
             
             return {
                 "success": True,
@@ -1,7 +1,130 @@
-from typing import Dict, List, Optional, Any
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
 from loguru import logger
-from agents.base_agent import BaseAgent
-from datetime import datetime
+from agents.base_agent import (
+    BaseAgent, current_date_str, format_medical_record, freeze_medical_record
+)
+
+# 响应解析关键词（每类编译为一个正则，每行只扫描一次）
+_SUMMARY_PATTERN = re.compile('总结|综上|因此|建议|诊断')
+_KEY_POINT_PATTERN = re.compile('诊断|治疗|建议|考虑|可能|需要')
+_DIAGNOSIS_PATTERN = re.compile('诊断|考虑|可能|鉴别|排除')
+_TREATMENT_PATTERN = re.compile('治疗|用药|手术|建议|方案')
+_MEDICATION_PATTERN = re.compile('用药|药物|治疗')
+_PROCEDURE_PATTERN = re.compile('手术|操作|治疗')
+_FOLLOW_UP_PATTERN = re.compile('随访|复查|监测')
+_WORD_PATTERN = re.compile(r'\S+')
+# 整行匹配，直接在全文上查找包含关键词的行
+_DIAGNOSIS_LINE_PATTERN = re.compile(f'^.*(?:{_DIAGNOSIS_PATTERN.pattern}).*$', re.M)
+_TREATMENT_LINE_PATTERN = re.compile(f'^.*(?:{_TREATMENT_PATTERN.pattern}).*$', re.M)
+# 列表项前缀：符号/数字编号与中文编号合并为一个元组，每行只调用一次 startswith
+_BULLET_PREFIXES = ('- ', '* ', '• ', '1.', '2.', '3.', '4.', '5.')
+_CN_BULLET_PREFIXES = ('一、', '二、', '三、', '四、', '五、')
+_LIST_ITEM_PREFIXES = _BULLET_PREFIXES + _CN_BULLET_PREFIXES
+
+
+def _content_lines(response: str) -> Tuple[str, ...]:
+    """拆分响应为去除首尾空白的非空行"""
+    return tuple(stripped for stripped in (line.strip() for line in response.split('\n')) if stripped)
+
+
+# 逻辑检查结果解析
+_LOGIC_SCORE_PATTERN = re.compile(r'(?:评分|得分|分数)\D{0,5}?(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:/\s*10|分)')
+_LOGIC_ISSUE_PATTERN = re.compile('问题|矛盾|跳跃|不足|缺乏|不充分')
+
+
+# 最近一次格式化的讨论历史 (历史列表, 键, 文本)
+# 列表不支持弱引用，只保留最近一份；同一轮中各智能体看到的是同一个历史列表
+_history_prompt_cache: Optional[Tuple[List[Dict], tuple, str]] = None
+
+
+@lru_cache(maxsize=512)
+def _build_specialty_prompt_cached(specialty: str, base_prompt: str, current_date: str) -> str:
+    """构建专科系统提示词（按专科、基础提示词和日期缓存）"""
+    return f"""你是一位{specialty}的资深专家医生。{base_prompt}
+
+请严格遵循以下指导原则：
+1. 每次讨论都要基于之前所有讨论内容进行更加深入探讨
+2. 特别关注之前各科专家提到的诊断、治疗与检查内容
+3. 从{specialty}专业角度分析可能存在的风险和并发症
+4. 必须提供详细的鉴别诊断分析，包括：
+   - 支持某项诊断的临床证据和理由
+   - 不支持某项诊断的排除依据和原因
+   - 各种可能性按概率排序
+5. 基于循证医学原则提出个体化建议
+6. 考虑多学科协作的治疗方案整合
+
+讨论要求：
+- 每次发言都要引用和回应之前专家的观点
+- 分析要基于最新的临床指南和证据
+- 重点关注跨专科的协同治疗和风险管控
+- 提供具体的检查建议和治疗时间节点
+
+当前日期：{current_date}
+请用专业、准确的语言进行深入分析。"""
+
+
+# 各类分析消息的固定部分
+_CASE_ANALYSIS_REQUIREMENTS = """
+
+    【要求】
+    请用500字以内简洁回答，可以包含：
+    1. 涉及机制判断及理由
+    2. 诊断和鉴别诊断建议及理由  
+    3. 治疗建议及理由
+    4. 检查建议及理由
+    """
+_TREATMENT_MESSAGE_HEADER = """请基于以下病例信息建议治疗方案：
+        
+病例信息:
+"""
+_TREATMENT_PLAN_ITEMS = """
+1. 药物治疗建议
+2. 非药物治疗建议  
+3. 随访计划
+4. 注意事项"""
+_CONCISE_ANSWER_REQUIREMENTS = """
+
+    请基于您的专业知识和当前讨论背景，提供简洁、专业的回答（控制在200字以内）。
+
+    要求：
+    1. 直接回答问题核心
+    2. 基于专业角度提供关键建议
+    3. 避免冗长的解释
+    4. 如需要更多信息请直接说明"""
+_FULL_ANSWER_REQUIREMENTS = """
+
+    请基于您的专业知识提供专业、准确的回答。"""
+
+# 决策消息模板的固定部分
+_DECISION_MESSAGE_HEADER = """作为临床决策专家，请基于以下多专科讨论结果，形成最终临床决策：
+
+【病历摘要】
+"""
+_DECISION_QUESTION_HEADER = """
+
+【讨论问题】  
+"""
+_DECISION_ANALYSES_HEADER = """
+
+【各专科意见汇总】
+"""
+_DECISION_MESSAGE_FOOTER = """
+
+【决策要求】
+请提供结构化的最终建议：
+1. 综合诊断意见（按可能性排序，附支持证据）
+2. 推荐的多学科治疗方案（分阶段、分专科）
+3. 必要的辅助检查建议和优先级
+4. 后续治疗计划和预后评估
+5. 关键风险提示和跨专科注意事项
+
+决策日期：{current_date}
+请确保建议基于各专科专家的深度分析，并考虑患者的整体情况。不要包含个人签名。"""
+
 
 class SpecialtyAgent(BaseAgent):
     """专科智能体类 - 修复版本"""
@@ -30,18 +153,7 @@ class SpecialtyAgent(BaseAgent):
         # 构建完整的系统提示词
         full_prompt = self._build_specialty_prompt(prompt, self.specialty)
         
-        # 正确处理logger参数
-        if logger is None:
-            from utils.logger import setup_logger
-            self.logger = setup_logger(f"agent_{self.agent_name}")
-        elif hasattr(logger, 'info'):  # 检查是否是真正的logger对象
-            self.logger = logger
-        else:
-            # 如果传递的是列表，创建新的logger
-            from utils.logger import setup_logger
-            self.logger = setup_logger(f"agent_{self.agent_name}")
-
-        # 最后调用父类初始化
+        # 最后调用父类初始化（logger参数由父类统一处理）
         super().__init__(
             args=args,
             specialty=specialty,
@@ -50,7 +162,7 @@ class SpecialtyAgent(BaseAgent):
             logger=logger
         )
             
-        self.logger.info(f"初始化专科智能体: {specialty}")
+        self.logger.info("初始化专科智能体: {}", specialty)
     
     def _get_default_registry(self):
         """延迟获取默认注册表"""
@@ -59,30 +171,44 @@ class SpecialtyAgent(BaseAgent):
     
     def _build_specialty_prompt(self, base_prompt: str, specialty: str) -> str:
         """构建专科专用的提示词 - 保留原有设置"""
-        current_date = datetime.now().strftime("%Y年%m月%d日")
-        return f"""你是一位{specialty}的资深专家医生。{base_prompt}
-
-请严格遵循以下指导原则：
-1. 每次讨论都要基于之前所有讨论内容进行更加深入探讨
-2. 特别关注之前各科专家提到的诊断、治疗与检查内容
-3. 从{specialty}专业角度分析可能存在的风险和并发症
-4. 必须提供详细的鉴别诊断分析，包括：
-   - 支持某项诊断的临床证据和理由
-   - 不支持某项诊断的排除依据和原因
-   - 各种可能性按概率排序
-5. 基于循证医学原则提出个体化建议
-6. 考虑多学科协作的治疗方案整合
-
-讨论要求：
-- 每次发言都要引用和回应之前专家的观点
-- 分析要基于最新的临床指南和证据
-- 重点关注跨专科的协同治疗和风险管控
-- 提供具体的检查建议和治疗时间节点
-
-当前日期：{current_date}
-请用专业、准确的语言进行深入分析。"""
+        return _build_specialty_prompt_cached(specialty, base_prompt, current_date_str())
       
     def analyze_clinical_case(self, medical_record: Dict, discussion_history: List[Dict] = None, specific_prompt: str = None) -> Dict[str, Any]:
+        message = self._build_clinical_case_message(medical_record, discussion_history, specific_prompt)
+        
+        try:
+            # 使用chat方法保持历史记录连续性
+            response = self.chat(message, temperature=0.3)  # 降低温度以获得更稳定的响应
+            return self._build_clinical_case_result(response)
+            
+        except Exception as e:
+            logger.error("临床病例分析错误: {}", e)
+            return {
+                "success": False,
+                "error": str(e),
+                "specialty": self.specialty
+            }
+    
+    async def aanalyze_clinical_case(self, medical_record: Dict, discussion_history: List[Dict] = None,
+                                     specific_prompt: str = None) -> Dict[str, Any]:
+        """分析临床病例（异步版本，供各专科智能体并发分析）"""
+        message = self._build_clinical_case_message(medical_record, discussion_history, specific_prompt)
+        
+        try:
+            response = "".join([delta async for delta in self.astream_chat(message, temperature=0.3)])
+            return self._build_clinical_case_result(response)
+            
+        except Exception as e:
+            logger.error("临床病例分析错误: {}", e)
+            return {
+                "success": False,
+                "error": str(e),
+                "specialty": self.specialty
+            }
+    
+    def _build_clinical_case_message(self, medical_record: Dict, discussion_history: List[Dict] = None,
+                                     specific_prompt: str = None) -> str:
+        """构建临床病例分析消息（同时设置共享历史记录）"""
         # 设置共享历史记录
         if discussion_history:
             self.set_shared_history(discussion_history)
@@ -99,397 +225,290 @@ class SpecialtyAgent(BaseAgent):
     {medical_text}
 
     【讨论历史】
-    {history_context}
-
-    【要求】
-    请用500字以内简洁回答，可以包含：
-    1. 涉及机制判断及理由
-    2. 诊断和鉴别诊断建议及理由  
-    3. 治疗建议及理由
-    4. 检查建议及理由
-    {prompt_section}
+    {history_context}{_CASE_ANALYSIS_REQUIREMENTS}{prompt_section}
     请专注于{self.specialty}专业领域，根据上述要点进行总结回答，不用分点，提供精炼的专业汇总意见。"""
+        return message
+    
+    def _build_clinical_case_result(self, response: str) -> Dict[str, Any]:
+        """构建临床病例分析结果"""
+        # 解析响应，确保简洁
+        concise_response = self._make_response_concise(response)
         
-        try:
-            # 使用chat方法保持历史记录连续性
-            response = self.chat(message, temperature=0.3)  # 降低温度以获得更稳定的响应
-            
-            # 解析响应，确保简洁
-            concise_response = self._make_response_concise(response)
-            
-            analysis_result = {
-                "success": True,
-                "specialty": self.specialty,
-                "concise_analysis": concise_response,
-                "word_count": len(concise_response),
-                "timestamp": self._get_timestamp()
-            }
-            
-            return analysis_result
-            
-        except Exception as e:
-            logger.error(f"临床病例分析错误: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "specialty": self.specialty
-            }
+        return {
+            "success": True,
+            "specialty": self.specialty,
+            "concise_analysis": concise_response,
+            "word_count": len(concise_response),
+            "timestamp": self._get_timestamp()
+        }
+    
     def _format_discussion_history_for_prompt(self, discussion_history: List[Dict]) -> str:
-        """格式化讨论历史用于提示词"""
+        """格式化讨论历史用于提示词（同一轮各智能体共享同一历史列表，只格式化一次）"""
         if not discussion_history:
             return "暂无讨论历史"
         
+        recent_rounds = discussion_history[-6:]  # 只取最近6轮
+        # 历史列表可能被原地追加轮次或发言，键中包含轮数和各轮发言数
+        cache_key = (len(discussion_history),
+                     tuple(len(round_data.get("contributions", ())) for round_data in recent_rounds))
+        global _history_prompt_cache
+        cached = _history_prompt_cache
+        if cached is not None and cached[0] is discussion_history and cached[1] == cache_key:
+            return cached[2]
+        
         formatted_history = []
-        for i, round_data in enumerate(discussion_history[-6:], 1):  # 只取最近6轮
+        for i, round_data in enumerate(recent_rounds, 1):
             round_num = round_data.get("round", i)
             formatted_history.append(f"第{round_num}轮讨论:")
             
             for contribution in round_data.get("contributions", []):
-                agent = contribution.get("agent", "")
                 analysis = contribution.get("contribution", {}).get("concise_analysis", "")
-                if analysis:
-                    short_analysis = analysis[:150] + "..." if len(analysis) > 150 else analysis
-                    formatted_history.append(f"  {agent}: {short_analysis}")
-        
-        return "\n".join(formatted_history) if formatted_history else "暂无相关讨论历史"
+                if not analysis:
+                    continue
+                agent = contribution.get("agent", "")
+                if len(analysis) > 150:
+                    formatted_history.append(f"  {agent}: {analysis[:150]}...")
+                else:
+                    formatted_history.append(f"  {agent}: {analysis}")
+        
+        text = "\n".join(formatted_history) if formatted_history else "暂无相关讨论历史"
+        _history_prompt_cache = (discussion_history, cache_key, text)
+        return text
     
     def _make_response_concise(self, response: str, max_words: int = 400) -> str:
         """确保响应简洁"""
-        words = response.split()
-        if len(words) <= max_words:
+        # 只数到 max_words + 1 个词，不拆分整个响应
+        word_count = sum(1 for _ in islice(_WORD_PATTERN.finditer(response), max_words + 1))
+        if word_count <= max_words:
             return response
         
         # 如果超过字数限制，提取关键部分
-        # 保留开头和结尾的重要信息
-        important_parts = words[:50] + words[-50:]
+        # 保留开头和结尾的重要信息（只从两端各拆分50个词）
+        important_parts = response.split(None, 50)[:50] + response.rsplit(None, 50)[-50:]
         return ' '.join(important_parts) + "...[内容已精简]"
        
     def _extract_medical_text(self, medical_record: Dict) -> str:
         """提取病历文本 - 支持多种格式"""
-        # 如果已经是字符串格式，直接返回
-        if isinstance(medical_record, str):
-            return medical_record
-        
-        # 如果是字典格式，提取关键信息
-        if isinstance(medical_record, dict):
-            # 优先使用自由文本字段
-            if 'free_text' in medical_record:
-                return medical_record['free_text']
-            elif 'text' in medical_record:
-                return medical_record['text']
-            elif 'content' in medical_record:
-                return medical_record['content']
-            else:
-                # 如果没有自由文本字段，将字典内容拼接成文本
-                return self._dict_to_text(medical_record)
-        
-        # 其他格式转换为字符串
-        return str(medical_record)
+        return self._format_medical_record_for_analysis(medical_record)
     
     def _dict_to_text(self, medical_dict: Dict) -> str:
         """将病历字典转换为文本 - 简洁格式"""
-        text_parts = []
-        
-        # 按常见病历字段顺序组织
-        common_fields = [
-            ('chief_complaint', '主诉'),
-            ('present_illness', '现病史'),
-            ('past_history', '既往史'),
-            ('physical_exam', '体格检查'),
-            ('lab_results', '辅助检查'),
-            ('vital_signs', '生命体征'),
-            ('diagnosis', '初步诊断')
-        ]
-        
-        for field_key, field_name in common_fields:
-            if field_key in medical_dict and medical_dict[field_key]:
-                text_parts.append(f"{field_name}: {medical_dict[field_key]}")
-        
-        # 添加其他字段
-        for key, value in medical_dict.items():
-            if key not in [f[0] for f in common_fields] and value:
-                text_parts.append(f"{key}: {value}")
-        
-        return '\n'.join(text_parts)
+        return format_medical_record(freeze_medical_record(medical_dict))
     
     def _parse_analysis_response(self, response: str) -> Dict[str, Any]:
         """解析分析响应"""
+        # 只拆分一次，各提取方法共用
+        lines = _content_lines(response)
         return {
             "success": True,
             "specialty": self.specialty,
             "raw_response": response,
-            "summary": self._extract_summary(response),
-            "key_points": self._extract_key_points(response),
+            "summary": self._extract_summary(response, lines),
+            "key_points": self._extract_key_points(response, lines),
             "diagnosis_suggestions": self._extract_diagnosis_suggestions(response),
             "treatment_recommendations": self._extract_treatment_recommendations(response)
         }
     
-    def _extract_summary(self, response: str) -> str:
-        """提取摘要 - 改进版本"""
-        # 尝试找到总结性语句
-        lines = [line.strip() for line in response.split('\n') if line.strip()]
+    def _extract_summary(self, response: str, lines: Tuple[str, ...] = None) -> str:
+        """提取摘要 - 改进版本（lines 为已拆分的非空行，未提供时自行拆分）"""
+        if lines is None:
+            lines = _content_lines(response)
         
-        # 寻找包含总结关键词的句子
-        summary_keywords = ['总结', '综上', '因此', '建议', '诊断']
-        summary_lines = []
+        # 寻找包含总结关键词的句子或适中长度的句子，取前3个
+        summary_lines = [
+            line for line in lines
+            if _SUMMARY_PATTERN.search(line) or 30 < len(line) < 200
+        ][:3]
         
-        for line in lines:
-            if any(keyword in line for keyword in summary_keywords):
-                summary_lines.append(line)
-            elif len(line) > 30 and len(line) < 200:  # 适中长度的句子
-                summary_lines.append(line)
-        
-        # 取前3个有意义的句子
         if summary_lines:
-            return ' '.join(summary_lines[:3])
+            return ' '.join(summary_lines)
         else:
             # 如果没有明显总结，取前100个字符
             return response[:100] + '...' if len(response) > 100 else response
     
-    def _extract_key_points(self, response: str) -> List[str]:
+    def _extract_key_points(self, response: str, lines: Tuple[str, ...] = None) -> List[str]:
         """提取关键点 - 改进版本"""
-        key_points = []
-        lines = response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            # 识别列表项
-            if (line.startswith(('- ', '* ', '• ', '1.', '2.', '3.', '4.', '5.')) or
-                line.startswith(('一、', '二、', '三、', '四、', '五、'))):
-                key_points.append(line)
-            # 识别重要陈述（包含关键词）
-            elif (any(keyword in line for keyword in 
-                     ['诊断', '治疗', '建议', '考虑', '可能', '需要']) and 
-                  len(line) > 10 and len(line) < 150):
-                key_points.append(line)
-        
+        if lines is None:
+            lines = _content_lines(response)
+        
+        key_points = [
+            line for line in lines
+            # 识别列表项，或包含关键词的重要陈述
+            if line.startswith(_LIST_ITEM_PREFIXES)
+            or (10 < len(line) < 150 and _KEY_POINT_PATTERN.search(line))
+        ]
         return key_points[:8]  # 最多返回8个关键点
     
     def _extract_diagnosis_suggestions(self, response: str) -> List[str]:
-        """提取诊断建议"""
-        diagnosis_keywords = ['诊断', '考虑', '可能', '鉴别', '排除']
-        suggestions = []
-        lines = response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line for keyword in diagnosis_keywords):
-                suggestions.append(line)
-        
-        return suggestions[:5]
+        """提取诊断建议（在全文上逐行匹配，取到5条即停止）"""
+        return [match.group().strip() for match in islice(_DIAGNOSIS_LINE_PATTERN.finditer(response), 5)]
     
     def _extract_treatment_recommendations(self, response: str) -> List[str]:
-        """提取治疗建议"""
-        treatment_keywords = ['治疗', '用药', '手术', '建议', '方案']
-        recommendations = []
-        lines = response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line for keyword in treatment_keywords):
-                recommendations.append(line)
-        
-        return recommendations[:5]
+        """提取治疗建议（在全文上逐行匹配，取到5条即停止）"""
+        return [match.group().strip() for match in islice(_TREATMENT_LINE_PATTERN.finditer(response), 5)]
     
     def _log_analysis(self, medical_record: Dict, question: str, result: Dict) -> None:
         """记录分析过程"""
-        if self.logger is not None:
-            log_entry = {
-                "timestamp": self._get_timestamp(),
-                "agent": self.agent_name,
-                "specialty": self.specialty,
-                "medical_record_preview": str(medical_record)[:100] + '...' if len(str(medical_record)) > 100 else str(medical_record),
-                "question": question,
-                "analysis_success": result.get("success", False),
-                "summary": result.get("summary", "") 
-            }
-            self.logger.append(log_entry)
+        log_entry = {
+            "timestamp": self._get_timestamp(),
+            "agent": self.agent_name,
+            "specialty": self.specialty,
+            "medical_record_preview": str(medical_record)[:100] + '...' if len(str(medical_record)) > 100 else str(medical_record),
+            "question": question,
+            "analysis_success": result.get("success", False),
+            "summary": result.get("summary", "") 
+        }
+        self._emit_log(log_entry)
     
     def provide_differential_diagnosis(self, medical_record: Dict) -> Dict[str, Any]:
         """
         提供鉴别诊断 - 支持自由文本输入
         """
-        medical_text = self._extract_medical_text(medical_record)
-        
-        message = f"""基于以下病例信息，请提供{self.specialty}相关的鉴别诊断：
-
-病例信息:
-{medical_text}
-
-请按可能性从高到低列出鉴别诊断，并简要说明理由。"""
+        message = self._build_ddx_message(medical_record)
         
         try:
             response = self.chat_without_history(message)
-            
-            return {
-                "success": True,
-                "specialty": self.specialty,
-                "differential_diagnosis": response,
-                "formatted_ddx": self._format_ddx_response(response)
-            }
+            return self._build_ddx_result(response)
             
         except Exception as e:
-            logger.error(f"鉴别诊断错误: {e}")
+            logger.error("鉴别诊断错误: {}", e)
             return {
                 "success": False,
                 "error": str(e)
             }
     
+    def _build_ddx_message(self, medical_record: Dict) -> str:
+        """构建鉴别诊断消息"""
+        medical_text = self._extract_medical_text(medical_record)
+        
+        return f"""基于以下病例信息，请提供{self.specialty}相关的鉴别诊断：
+
+病例信息:
+{medical_text}
+
+请按可能性从高到低列出鉴别诊断，并简要说明理由。"""
+    
+    def _build_ddx_result(self, response: str) -> Dict[str, Any]:
+        """构建鉴别诊断结果"""
+        return {
+            "success": True,
+            "specialty": self.specialty,
+            "differential_diagnosis": response,
+            "formatted_ddx": self._format_ddx_response(response)
+        }
+    
     def _format_ddx_response(self, response: str) -> List[Dict]:
         """格式化鉴别诊断响应"""
-        # 简单的解析逻辑，可根据需要增强
+        # 简单的解析逻辑，可根据需要增强；最多返回10个诊断，取够即停止
         diagnoses = []
-        lines = response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):  # 忽略注释行
-                diagnoses.append({
-                    "diagnosis": line[:100],  # 限制长度
-                    "reasoning": "待进一步分析"
-                })
-        
-        return diagnoses[:10]  # 最多返回10个诊断
+        for line in _content_lines(response):
+            if line.startswith('#'):  # 忽略注释行
+                continue
+            diagnoses.append({
+                "diagnosis": line[:100],  # 限制长度
+                "reasoning": "待进一步分析"
+            })
+            if len(diagnoses) == 10:
+                break
+        
+        return diagnoses
     
     def suggest_treatment_plan(self, medical_record: Dict, diagnosis: str = None) -> Dict[str, Any]:
         """
         建议治疗方案 - 支持自由文本输入
         """
-        medical_text = self._extract_medical_text(medical_record)
-        
-        message = f"""请基于以下病例信息建议治疗方案：
-        
-病例信息:
-{medical_text}"""
-        
-        if diagnosis:
-            message += f"\n\n初步诊断: {diagnosis}"
-        
-        message += f"""
-
-请从{self.specialty}角度建议治疗方案，包括：
-1. 药物治疗建议
-2. 非药物治疗建议  
-3. 随访计划
-4. 注意事项"""
+        message = self._build_treatment_message(medical_record, diagnosis)
         
         try:
             response = self.chat_without_history(message)
-            
-            return {
-                "success": True,
-                "specialty": self.specialty,
-                "treatment_plan": response,
-                "structured_plan": self._parse_treatment_plan(response)
-            }
+            return self._build_treatment_result(response)
             
         except Exception as e:
-            logger.error(f"治疗方案建议错误: {e}")
+            logger.error("治疗方案建议错误: {}", e)
             return {
                 "success": False,
                 "error": str(e)
             }
     
+    def _build_treatment_message(self, medical_record: Dict, diagnosis: str = None) -> str:
+        """构建治疗方案建议消息"""
+        medical_text = self._extract_medical_text(medical_record)
+        
+        diagnosis_section = f"\n\n初步诊断: {diagnosis}" if diagnosis else ""
+        
+        return (f"{_TREATMENT_MESSAGE_HEADER}{medical_text}{diagnosis_section}"
+                f"\n\n请从{self.specialty}角度建议治疗方案，包括：{_TREATMENT_PLAN_ITEMS}")
+    
+    def _build_treatment_result(self, response: str) -> Dict[str, Any]:
+        """构建治疗方案建议结果"""
+        return {
+            "success": True,
+            "specialty": self.specialty,
+            "treatment_plan": response,
+            "structured_plan": self._parse_treatment_plan(response)
+        }
+    
     def _parse_treatment_plan(self, response: str) -> Dict[str, List]:
         """解析治疗方案"""
         # 简单的解析逻辑
-        lines = [line.strip() for line in response.split('\n') if line.strip()]
+        lines = _content_lines(response)
         
         return {
-            "medications": [line for line in lines if any(word in line for word in ['用药', '药物', '治疗'])][:5],
-            "procedures": [line for line in lines if any(word in line for word in ['手术', '操作', '治疗'])][:5],
-            "follow_up": [line for line in lines if any(word in line for word in ['随访', '复查', '监测'])][:5],
-            "notes": lines[:10]  # 返回前10行作为备注
+            "medications": [line for line in lines if _MEDICATION_PATTERN.search(line)][:5],
+            "procedures": [line for line in lines if _PROCEDURE_PATTERN.search(line)][:5],
+            "follow_up": [line for line in lines if _FOLLOW_UP_PATTERN.search(line)][:5],
+            "notes": list(lines[:10])  # 返回前10行作为备注
         }
 
-    def respond_to_user_question(self, question: str, context: Dict = None) -> Dict[str, Any]:
-        """
-        响应用户提问 - 增强版本
-        """
-        try:
-            # 构建响应消息
-            message = f"""用户向您提问：{question}
-
-请基于您的专业知识提供专业、准确的回答。"""
-            
-            if context and context.get('discussion_context'):
-                message += f"\n\n当前讨论背景：{context['discussion_context']}"
-            
-            if context and context.get('medical_record'):
-                message += f"\n\n相关病例信息：{self._format_medical_record_for_analysis(context['medical_record'])}"
-            
-            # 使用chat_without_history确保响应独立
-            response = self.chat_without_history(message)
-            
-            return {
-                "success": True,
-                "agent_name": self.agent_name,
-                "question": question,
-                "response": response,
-                "timestamp": self._get_timestamp()
-            }
-            
-        except Exception as e:
-            self.logger.error(f"响应用户提问失败: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "agent_name": self.agent_name
-            }
-
     def respond_to_user_question(self, question: str, context: Dict = None, concise: bool = False) -> Dict[str, Any]:
         """
         响应用户提问 - 增强版本，支持简洁模式
         """
         try:
-            # 构建响应消息
-            if concise:
-                # 简洁模式：限制回答长度
-                message = f"""用户向您提问：{question}
-
-    请基于您的专业知识和当前讨论背景，提供简洁、专业的回答（控制在200字以内）。
-
-    要求：
-    1. 直接回答问题核心
-    2. 基于专业角度提供关键建议
-    3. 避免冗长的解释
-    4. 如需要更多信息请直接说明"""
-            else:
-                # 完整模式
-                message = f"""用户向您提问：{question}
-
-    请基于您的专业知识提供专业、准确的回答。"""
-            
-            if context and context.get('discussion_context'):
-                message += f"\n\n当前讨论背景：{context['discussion_context']}"
-            
-            if context and context.get('medical_record'):
-                message += f"\n\n相关病例信息：{self._format_medical_record_for_analysis(context['medical_record'])}"
+            message = self._build_user_question_message(question, context, concise)
             
             # 使用chat_without_history确保响应独立
             response = self.chat_without_history(message)
             
-            # 如果启用简洁模式，控制回答长度
-            if concise and len(response) > 200:
-                response = response[:200] + "...[回答已精简]"
-            
-            return {
-                "success": True,
-                "agent_name": self.agent_name,
-                "question": question,
-                "response": response,
-                "concise_mode": concise,
-                "word_count": len(response),
-                "timestamp": self._get_timestamp()
-            }
+            return self._build_user_question_result(question, response, concise)
             
         except Exception as e:
-            self.logger.error(f"响应用户提问失败: {e}")
+            self.logger.error("响应用户提问失败: {}", e)
             return {
                 "success": False,
                 "error": str(e),
                 "agent_name": self.agent_name
             }
+    
+    def _build_user_question_message(self, question: str, context: Dict = None, concise: bool = False) -> str:
+        """构建用户提问消息"""
+        # 简洁模式限制回答长度，完整模式不限制
+        requirements = _CONCISE_ANSWER_REQUIREMENTS if concise else _FULL_ANSWER_REQUIREMENTS
+        parts = ["用户向您提问：", question, requirements]
+        
+        if context and context.get('discussion_context'):
+            parts += ["\n\n当前讨论背景：", context['discussion_context']]
+        
+        if context and context.get('medical_record'):
+            parts += ["\n\n相关病例信息：", self._format_medical_record_for_analysis(context['medical_record'])]
+        
+        return "".join(parts)
+    
+    def _build_user_question_result(self, question: str, response: str, concise: bool = False) -> Dict[str, Any]:
+        """构建用户提问响应结果"""
+        # 如果启用简洁模式，控制回答长度
+        if concise and len(response) > 200:
+            response = response[:200] + "...[回答已精简]"
+        
+        return {
+            "success": True,
+            "agent_name": self.agent_name,
+            "question": question,
+            "response": response,
+            "concise_mode": concise,
+            "word_count": len(response),
+            "timestamp": self._get_timestamp()
+        }
 
 class SpecialtyAgentFactory:
     """专科智能体工厂类 - 优化版本"""
@@ -533,21 +552,35 @@ class SpecialtyAgentFactory:
         Returns:
             智能体字典 {专科名: 智能体实例}
         """
-        agents = {}
-        for config in agent_configs:
-            try:
-                agent = SpecialtyAgentFactory.create_agent(
+        if not agent_configs:
+            return {}
+        
+        # logger参数可能是列表或None，此时使用模块日志记录器
+        from loguru import logger as default_logger
+        log = logger if hasattr(logger, 'info') else default_logger
+        
+        # 各智能体的注册表查询和客户端初始化在线程池中并行进行（客户端共享连接池）
+        with ThreadPoolExecutor(max_workers=min(32, len(agent_configs))) as executor:
+            futures = [
+                executor.submit(
+                    SpecialtyAgentFactory.create_agent,
                     args=args,
                     specialty=config['specialty'],
                     prompt=config.get('prompt', ''),
                     agent_name=config.get('agent_name'),
                     logger=logger
                 )
-                agents[config['specialty']] = agent
-                logger.info(f"成功创建专科智能体: {config['specialty']}")
+                for config in agent_configs
+            ]
+        
+        # 按配置顺序收集结果
+        agents = {}
+        for config, future in zip(agent_configs, futures):
+            try:
+                agents[config['specialty']] = future.result()
+                log.info(f"成功创建专科智能体: {config['specialty']}")
             except Exception as e:
-                logger.error(f"创建专科智能体失败 {config['specialty']}: {e}")
-                continue
+                log.error(f"创建专科智能体失败 {config['specialty']}: {e}")
         
         return agents
     
@@ -583,11 +616,25 @@ class LogicAgent(BaseAgent):
             "full_analysis": response
         }
     
+    def _extract_logic_score(self, response: str) -> Optional[float]:
+        """提取逻辑评分（如“评分：8/10”“8分”），未给出评分时返回None"""
+        match = _LOGIC_SCORE_PATTERN.search(response)
+        return float(match.group(1) or match.group(2)) if match else None
+    
+    def _identify_logic_issues(self, response: str) -> List[str]:
+        """提取逻辑问题"""
+        return [line.strip() for line in response.splitlines()
+                if _LOGIC_ISSUE_PATTERN.search(line)][:5]
+    
+    def _extract_suggestions(self, response: str) -> List[str]:
+        """提取改进建议"""
+        return [line.strip() for line in response.splitlines() if '建议' in line][:5]
+    
 class DecisionMakersAgent(BaseAgent):
     """决策智能体 - 完整修复版本"""
         
     def __init__(self, args, specialty="决策专家", agent_name="DecisionMaker", logger=None):
-        current_date = datetime.now().strftime("%Y年%m月%d日")
+        current_date = current_date_str()
         
         system_prompt = f"""你是临床决策专家，负责整合各专科意见，形成统一的诊断、鉴别诊断和治疗方案。
     请基于各专科专家的分析，综合考虑患者的整体情况，提出最终建议。
@@ -613,15 +660,8 @@ class DecisionMakersAgent(BaseAgent):
     def make_final_decision(self, agents: Dict, discussion_log: List, medical_context: Dict) -> Dict[str, Any]:
         """生成最终决策"""
         try:
-            # 提取所有智能体的分析结果
-            all_analyses = []
-            for round_log in discussion_log:
-                for contribution in round_log.get("contributions", []):
-                    if "contribution" in contribution and contribution["contribution"].get("success"):
-                        analysis = contribution["contribution"].get("concise_analysis", "")
-                        all_analyses.append(f"{contribution['agent']}: {analysis}")
-            
             # 构建更结构化的决策消息
+            all_analyses = self._collect_analyses(discussion_log)
             message = self._build_decision_message(medical_context, all_analyses)
             
             # 使用chat_without_history确保决策独立性
@@ -630,38 +670,35 @@ class DecisionMakersAgent(BaseAgent):
             return self._parse_decision_response(response)
             
         except Exception as e:
-            logger.error(f"最终决策生成失败: {e}")
+            logger.error("最终决策生成失败: {}", e)
             return {
                 "success": False,
                 "error": str(e)
             }
+    
+    def _collect_analyses(self, discussion_log: List) -> List[str]:
+        """提取所有智能体的分析结果"""
+        all_analyses = []
+        for round_log in discussion_log:
+            for contribution in round_log.get("contributions", []):
+                if "contribution" in contribution and contribution["contribution"].get("success"):
+                    analysis = contribution["contribution"].get("concise_analysis", "")
+                    all_analyses.append(f"{contribution['agent']}: {analysis}")
+        return all_analyses
 
     def _build_decision_message(self, medical_context: Dict, analyses: List[str]) -> str:
-        """构建决策消息"""
-        current_date = datetime.now().strftime("%Y年%m月%d日")
-        medical_record = medical_context.get('medical_record', '')
-            
-        return f"""作为临床决策专家，请基于以下多专科讨论结果，形成最终临床决策：
-
-【病历摘要】
-{medical_record}
-
-【讨论问题】  
-{medical_context.get('question', '')}
-
-【各专科意见汇总】
-{chr(10).join(analyses)}
-
-【决策要求】
-请提供结构化的最终建议：
-1. 综合诊断意见（按可能性排序，附支持证据）
-2. 推荐的多学科治疗方案（分阶段、分专科）
-3. 必要的辅助检查建议和优先级
-4. 后续治疗计划和预后评估
-5. 关键风险提示和跨专科注意事项
-
-决策日期：{current_date}
-请确保建议基于各专科专家的深度分析，并考虑患者的整体情况。不要包含个人签名。"""
+        """构建决策消息（各部分一次拼接，避免汇总意见先单独join再复制进模板）"""
+        parts = [
+            _DECISION_MESSAGE_HEADER, str(medical_context.get('medical_record', '')),
+            _DECISION_QUESTION_HEADER, str(medical_context.get('question', '')),
+            _DECISION_ANALYSES_HEADER
+        ]
+        for index, analysis in enumerate(analyses):
+            if index:
+                parts.append('\n')
+            parts.append(analysis)
+        parts.append(_DECISION_MESSAGE_FOOTER.format(current_date=current_date_str()))
+        return ''.join(parts)
 
     def _parse_decision_response(self, response: str) -> Dict[str, Any]:
         """解析决策响应"""
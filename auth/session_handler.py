@@ -5,25 +5,48 @@
 负责用户会话的创建、验证、管理和清理
 """
 
+import base64
+import heapq
 import secrets
+import sys
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Set, Tuple
 from dataclasses import dataclass
 import threading
+from contextlib import contextmanager
 from loguru import logger
+from utils.timeutils import now_iso
 
+# 会话表分片数（必须为2的幂），每个分片有独立的锁
+SESSION_SHARD_COUNT = 16
 
-@dataclass
+# 会话ID随机字节数（192位熵，编码后为32个字符）
+SESSION_ID_BYTES = 24
+_token_bytes = secrets.token_bytes
+
+
+# Python 3.10+ 为数据类生成 __slots__（减少每个实例的内存并加快属性访问）
+_DATACLASS_OPTIONS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_OPTIONS)
 class SessionData:
     """会话数据类"""
     session_id: str
     user_id: str
     created_at: datetime
-    last_activity: datetime
     custom_agents: Dict[str, Any]  # 自定义智能体
     discussion_data: Dict[str, Any]  # 当前讨论数据
     user_preferences: Dict[str, Any]  # 用户偏好
+    # 单调时钟时间（time.monotonic()），超时判断只比较浮点数，不创建datetime对象
+    created_at_mono: float = 0.0
+    last_activity_mono: float = 0.0
+
+    @property
+    def last_activity(self) -> datetime:
+        """最后活动时间（由单调时钟换算，仅用于展示）"""
+        return datetime.now() - timedelta(seconds=time.monotonic() - self.last_activity_mono)
 
 
 class SessionHandler:
@@ -41,16 +64,74 @@ class SessionHandler:
             cleanup_interval: 清理间隔（秒）
         """
         self.session_timeout = session_timeout
-        self.active_sessions: Dict[str, SessionData] = {}
-        self.session_lock = threading.Lock()
+        # 距上次记录的活动时间超过该间隔才刷新，大多数请求不写会话对象；
+        # 代价是会话最多可能比精确的滑动过期提前 session_timeout 的10% 失效
+        self.activity_refresh_interval = session_timeout * 0.1
+        # 会话表按会话ID分片：单次字典读写在GIL下是原子的，读路径不加锁；
+        # 增删会话和修改会话内容时只锁所在分片，避免所有请求争用同一把锁
+        self._shards: List[Dict[str, SessionData]] = [{} for _ in range(SESSION_SHARD_COUNT)]
+        self._shard_locks = [threading.Lock() for _ in range(SESSION_SHARD_COUNT)]
+        # 过期时间小顶堆 [(到期的单调时钟时间, 会话ID)]，刷新活动时间时压入新条目，
+        # 旧条目不删除，清理时对照会话的实际活动时间跳过
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._expiry_lock = threading.Lock()
+        # 用户ID -> 会话ID集合的反向索引，以及用于统计的会话数和创建时间之和
+        self._user_index: Dict[str, Set[str]] = {}
+        self._session_count = 0
+        self._created_mono_sum = 0.0
+        self._index_lock = threading.Lock()
         
         # 启动后台清理线程
         self.cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
         self.cleanup_interval = cleanup_interval
-        self._stop_cleanup = False
+        self._stop_event = threading.Event()
         self.cleanup_thread.start()
         
-        logger.info(f"会话处理器初始化完成，超时时间: {session_timeout}秒")
+        logger.info("会话处理器初始化完成，超时时间: {}秒", session_timeout)
+
+    def _shard(self, session_id: str) -> Dict[str, SessionData]:
+        """会话ID所在的分片"""
+        return self._shards[hash(session_id) & (SESSION_SHARD_COUNT - 1)]
+
+    def _shard_lock(self, session_id: str) -> threading.Lock:
+        """会话ID所在分片的锁"""
+        return self._shard_locks[hash(session_id) & (SESSION_SHARD_COUNT - 1)]
+
+    def _index_session(self, session_data: SessionData) -> None:
+        """将会话加入用户索引和统计"""
+        with self._index_lock:
+            self._user_index.setdefault(session_data.user_id, set()).add(session_data.session_id)
+            self._session_count += 1
+            self._created_mono_sum += session_data.created_at_mono
+
+    def _unindex_session(self, session_data: SessionData) -> None:
+        """将会话移出用户索引和统计"""
+        self._unindex_sessions((session_data,))
+
+    def _unindex_sessions(self, sessions: Iterable[SessionData]) -> None:
+        """将一批会话移出用户索引和统计（只加一次锁）"""
+        with self._index_lock:
+            for session_data in sessions:
+                user_sessions = self._user_index.get(session_data.user_id)
+                if user_sessions is not None:
+                    user_sessions.discard(session_data.session_id)
+                    if not user_sessions:
+                        del self._user_index[session_data.user_id]
+                self._session_count -= 1
+                self._created_mono_sum -= session_data.created_at_mono
+
+    def _schedule_expiry(self, session_id: str, last_activity_mono: float) -> None:
+        """记录会话的到期时间"""
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, (last_activity_mono + self.session_timeout, session_id))
+
+    @property
+    def active_sessions(self) -> Dict[str, SessionData]:
+        """所有活跃会话的快照（合并各分片）"""
+        sessions = {}
+        for shard in self._shards:
+            sessions.update(shard.copy())
+        return sessions
 
     def _generate_session_id(self) -> str:
         """
@@ -59,7 +140,7 @@ class SessionHandler:
         Returns:
             str: 会话ID
         """
-        return secrets.token_urlsafe(32)
+        return base64.urlsafe_b64encode(_token_bytes(SESSION_ID_BYTES)).decode('ascii')
 
     def create_session(self, user_id: str, user_preferences: Dict = None) -> str:
         """
@@ -73,22 +154,25 @@ class SessionHandler:
             str: 会话ID
         """
         session_id = self._generate_session_id()
-        now = datetime.now()
+        now_mono = time.monotonic()
         
         session_data = SessionData(
             session_id=session_id,
             user_id=user_id,
-            created_at=now,
-            last_activity=now,
+            created_at=datetime.now(),
             custom_agents={},
             discussion_data={},
-            user_preferences=user_preferences or {}
+            user_preferences=user_preferences or {},
+            created_at_mono=now_mono,
+            last_activity_mono=now_mono
         )
         
-        with self.session_lock:
-            self.active_sessions[session_id] = session_data
+        with self._shard_lock(session_id):
+            self._shard(session_id)[session_id] = session_data
+        self._index_session(session_data)
+        self._schedule_expiry(session_id, now_mono)
         
-        logger.info(f"创建新会话: {session_id} for user: {user_id}")
+        logger.info("创建新会话: {} for user: {}", session_id, user_id)
         return session_id
 
     def validate_session(self, session_id: str) -> Tuple[bool, Optional[SessionData]]:
@@ -101,23 +185,51 @@ class SessionHandler:
         Returns:
             Tuple[是否有效, 会话数据]
         """
-        with self.session_lock:
-            if session_id not in self.active_sessions:
-                return False, None
-            
-            session_data = self.active_sessions[session_id]
-            now = datetime.now()
-            
-            # 检查是否超时
-            time_since_activity = (now - session_data.last_activity).total_seconds()
-            if time_since_activity > self.session_timeout:
-                logger.info(f"会话超时: {session_id}")
-                del self.active_sessions[session_id]
-                return False, None
-            
-            # 更新最后活动时间
-            session_data.last_activity = now
-            return True, session_data
+        session_data = self._shard(session_id).get(session_id)
+        if session_data is None:
+            return False, None
+        
+        now_mono = time.monotonic()
+        idle = now_mono - session_data.last_activity_mono
+        
+        # 检查是否超时
+        if idle > self.session_timeout:
+            logger.debug("会话超时: {}", session_id)
+            self._remove_session(session_id, session_data)
+            return False, None
+        
+        # 按间隔更新最后活动时间（属性赋值在GIL下是原子的）
+        if idle > self.activity_refresh_interval:
+            session_data.last_activity_mono = now_mono
+            self._schedule_expiry(session_id, now_mono)
+        return True, session_data
+
+    @contextmanager
+    def _session_ctx(self, session_id: str) -> Iterator[Optional[SessionData]]:
+        """
+        验证会话并在持有所在分片锁期间提供会话数据，用于修改会话内容
+        
+        会话无效或在加锁前已被销毁时提供None
+        """
+        is_valid, session_data = self.validate_session(session_id)
+        if not is_valid:
+            yield None
+            return
+        
+        with self._shard_lock(session_id):
+            if self._shard(session_id).get(session_id) is not session_data:
+                session_data = None
+            yield session_data
+
+    def _remove_session(self, session_id: str, session_data: SessionData) -> bool:
+        """从分片中删除会话（仅当表中仍是同一会话对象时）"""
+        with self._shard_lock(session_id):
+            shard = self._shard(session_id)
+            if shard.get(session_id) is not session_data:
+                return False
+            del shard[session_id]
+        self._unindex_session(session_data)
+        return True
 
     def update_session_activity(self, session_id: str) -> bool:
         """
@@ -129,11 +241,14 @@ class SessionHandler:
         Returns:
             bool: 是否更新成功
         """
-        with self.session_lock:
-            if session_id in self.active_sessions:
-                self.active_sessions[session_id].last_activity = datetime.now()
-                return True
+        session_data = self._shard(session_id).get(session_id)
+        if session_data is None:
             return False
+        now_mono = time.monotonic()
+        if now_mono - session_data.last_activity_mono > self.activity_refresh_interval:
+            session_data.last_activity_mono = now_mono
+            self._schedule_expiry(session_id, now_mono)
+        return True
 
     def get_session_data(self, session_id: str) -> Optional[SessionData]:
         """
@@ -145,8 +260,7 @@ class SessionHandler:
         Returns:
             Optional[SessionData]: 会话数据
         """
-        with self.session_lock:
-            return self.active_sessions.get(session_id)
+        return self._shard(session_id).get(session_id)
 
     def add_custom_agent(self, session_id: str, agent_name: str, agent_config: Dict) -> bool:
         """
@@ -160,18 +274,16 @@ class SessionHandler:
         Returns:
             bool: 是否添加成功
         """
-        is_valid, session_data = self.validate_session(session_id)
-        if not is_valid:
-            return False
-        
-        with self.session_lock:
+        with self._session_ctx(session_id) as session_data:
+            if session_data is None:
+                return False
             session_data.custom_agents[agent_name] = {
                 'config': agent_config,
-                'created_at': datetime.now().isoformat(),
+                'created_at': now_iso(),
                 'usage_count': 0
             }
         
-        logger.debug(f"会话 {session_id} 添加自定义智能体: {agent_name}")
+        logger.debug("会话 {} 添加自定义智能体: {}", session_id, agent_name)
         return True
 
     def get_custom_agents(self, session_id: str) -> Dict[str, Any]:
@@ -201,14 +313,10 @@ class SessionHandler:
         Returns:
             bool: 是否移除成功
         """
-        is_valid, session_data = self.validate_session(session_id)
-        if not is_valid:
-            return False
-        
-        with self.session_lock:
-            if agent_name in session_data.custom_agents:
+        with self._session_ctx(session_id) as session_data:
+            if session_data is not None and agent_name in session_data.custom_agents:
                 del session_data.custom_agents[agent_name]
-                logger.debug(f"会话 {session_id} 移除自定义智能体: {agent_name}")
+                logger.debug("会话 {} 移除自定义智能体: {}", session_id, agent_name)
                 return True
         return False
 
@@ -223,11 +331,9 @@ class SessionHandler:
         Returns:
             bool: 是否更新成功
         """
-        is_valid, session_data = self.validate_session(session_id)
-        if not is_valid:
-            return False
-        
-        with self.session_lock:
+        with self._session_ctx(session_id) as session_data:
+            if session_data is None:
+                return False
             session_data.discussion_data.update(discussion_data)
         return True
 
@@ -257,11 +363,9 @@ class SessionHandler:
         Returns:
             bool: 是否清空成功
         """
-        is_valid, session_data = self.validate_session(session_id)
-        if not is_valid:
-            return False
-        
-        with self.session_lock:
+        with self._session_ctx(session_id) as session_data:
+            if session_data is None:
+                return False
             session_data.discussion_data = {}
         return True
 
@@ -275,13 +379,14 @@ class SessionHandler:
         Returns:
             bool: 是否销毁成功
         """
-        with self.session_lock:
-            if session_id in self.active_sessions:
-                user_id = self.active_sessions[session_id].user_id
-                del self.active_sessions[session_id]
-                logger.info(f"销毁会话: {session_id} for user: {user_id}")
-                return True
-        return False
+        with self._shard_lock(session_id):
+            session_data = self._shard(session_id).pop(session_id, None)
+        
+        if session_data is None:
+            return False
+        self._unindex_session(session_data)
+        logger.info("销毁会话: {} for user: {}", session_id, session_data.user_id)
+        return True
 
     def get_user_sessions(self, user_id: str) -> List[str]:
         """
@@ -293,12 +398,8 @@ class SessionHandler:
         Returns:
             List[str]: 会话ID列表
         """
-        sessions = []
-        with self.session_lock:
-            for session_id, session_data in self.active_sessions.items():
-                if session_data.user_id == user_id:
-                    sessions.append(session_id)
-        return sessions
+        with self._index_lock:
+            return list(self._user_index.get(user_id, ()))
 
     def get_session_stats(self) -> Dict[str, Any]:
         """
@@ -307,57 +408,72 @@ class SessionHandler:
         Returns:
             Dict[str, Any]: 统计信息
         """
-        with self.session_lock:
-            total_sessions = len(self.active_sessions)
-            
+        now_mono = time.monotonic()
+        with self._index_lock:
+            total_sessions = self._session_count
             # 按用户分组统计
-            user_session_count = {}
-            for session_data in self.active_sessions.values():
-                user_id = session_data.user_id
-                user_session_count[user_id] = user_session_count.get(user_id, 0) + 1
-            
-            # 计算平均会话时长
-            now = datetime.now()
-            total_duration = 0
-            for session_data in self.active_sessions.values():
-                duration = (now - session_data.created_at).total_seconds()
-                total_duration += duration
-            
-            avg_duration = total_duration / total_sessions if total_sessions > 0 else 0
-            
-            return {
-                'total_sessions': total_sessions,
-                'unique_users': len(user_session_count),
-                'average_duration_seconds': avg_duration,
-                'sessions_per_user': user_session_count
-            }
+            user_session_count = {user_id: len(sessions) for user_id, sessions in self._user_index.items()}
+            # 平均会话时长 = (当前时间 * 会话数 - 创建时间之和) / 会话数
+            total_duration = now_mono * total_sessions - self._created_mono_sum
+        
+        avg_duration = total_duration / total_sessions if total_sessions > 0 else 0
+        
+        return {
+            'total_sessions': total_sessions,
+            'unique_users': len(user_session_count),
+            'average_duration_seconds': avg_duration,
+            'sessions_per_user': user_session_count
+        }
 
     def _cleanup_expired_sessions(self):
-        """清理过期会话"""
-        now = datetime.now()
+        """清理过期会话（只处理过期堆中已到期的条目，不扫描整个会话表）"""
+        now_mono = time.monotonic()
+        
+        # 按分片归组到期条目，每个分片只加一次锁
+        due_by_shard: Dict[int, List[str]] = {}
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] < now_mono:
+                session_id = heapq.heappop(self._expiry_heap)[1]
+                due_by_shard.setdefault(hash(session_id) & (SESSION_SHARD_COUNT - 1), []).append(session_id)
+        
         expired_sessions = []
+        for index, session_ids in due_by_shard.items():
+            shard = self._shards[index]
+            with self._shard_locks[index]:
+                for session_id in session_ids:
+                    session_data = shard.get(session_id)
+                    # 会话已销毁或之后刷新过活动时间（堆中另有新条目），跳过过时条目
+                    if session_data is None or now_mono - session_data.last_activity_mono <= self.session_timeout:
+                        continue
+                    del shard[session_id]
+                    expired_sessions.append(session_data)
         
-        with self.session_lock:
-            for session_id, session_data in self.active_sessions.items():
-                time_since_activity = (now - session_data.last_activity).total_seconds()
-                if time_since_activity > self.session_timeout:
-                    expired_sessions.append(session_id)
-            
-            # 删除过期会话
-            for session_id in expired_sessions:
-                user_id = self.active_sessions[session_id].user_id
-                del self.active_sessions[session_id]
-                logger.info(f"清理过期会话: {session_id} for user: {user_id}")
+        self._unindex_sessions(expired_sessions)
+        for session_data in expired_sessions:
+            logger.debug("清理过期会话: {} for user: {}", session_data.session_id, session_data.user_id)
         
         if expired_sessions:
-            logger.info(f"清理了 {len(expired_sessions)} 个过期会话")
+            logger.info("清理了 {} 个过期会话", len(expired_sessions))
 
     def _cleanup_worker(self):
-        """后台清理工作线程"""
-        while not self._stop_cleanup:
+        """后台清理工作线程（等待期间收到停止信号立即退出）"""
+        while not self._stop_event.is_set():
             try:
                 self._cleanup_expired_sessions()
-                time.sleep(self.cleanup_interval)
+                wait_seconds = self.cleanup_interval
             except Exception as e:
-                logger.error(f"会话清理工作线程错误: {e}")
-                time.sleep(60)  #
\ No newline at end of file
+                logger.error("会话清理工作线程错误: {}", e)
+                wait_seconds = 60
+            if self._stop_event.wait(wait_seconds):
+                return
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        停止后台清理线程
+        
+        Args:
+            timeout: 等待线程退出的最长时间（秒），None表示一直等待
+        """
+        self._stop_event.set()
+        if self.cleanup_thread.is_alive() and self.cleanup_thread is not threading.current_thread():
+            self.cleanup_thread.join(timeout)
@@ -5,23 +5,104 @@
 负责用户认证、注册、数据持久化等功能
 """
 
-import json
+import atexit
+import hashlib
+import hmac
 import os
 import secrets
-from datetime import datetime, timedelta
+import sys
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import logging
 from loguru import logger
 import jwt
+from utils import fastjson
+from utils.timeutils import now_iso
 
 from dataclasses import dataclass, field
 
+try:
+    import bcrypt
+    HAS_BCRYPT = True
+except ImportError:
+    HAS_BCRYPT = False
+
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
 """
 统一的用户管理模块
 """
 
-@dataclass
+# 后台压缩检查的合并窗口（秒）
+SAVE_FLUSH_INTERVAL = 1.0
+# 用户修改日志超过快照大小的该倍数（且不小于下限字节数）时，合并进 users.json 并清空日志
+LOG_COMPACT_RATIO = 1.0
+LOG_COMPACT_MIN_BYTES = 64 * 1024
+# 认证结果缓存：同一用户名和密码在有效期内再次登录时跳过密码校验
+AUTH_CACHE_TTL = 300.0
+AUTH_CACHE_MAX_SIZE = 10_000
+# 未安装bcrypt时使用标准库 PBKDF2-SHA256 的迭代次数
+PBKDF2_ITERATIONS = 200_000
+
+
+def hash_password(password: str) -> str:
+    """
+    生成密码哈希（优先bcrypt，未安装时使用PBKDF2-SHA256）
+    
+    Args:
+        password: 明文密码
+        
+    Returns:
+        str: 可直接存储的哈希字符串
+    """
+    if HAS_BCRYPT:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(12)).decode('ascii')
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def is_password_hash(stored_password: str) -> bool:
+    """存储的密码是否为哈希（旧数据中为明文）"""
+    return stored_password.startswith(("$2a$", "$2b$", "$2y$", "pbkdf2_sha256$"))
+
+
+def check_password(password: str, stored_password: str) -> bool:
+    """
+    校验密码（恒定时间比较）
+    
+    Args:
+        password: 用户输入的密码
+        stored_password: 存储的哈希，旧数据中的明文密码也可校验
+        
+    Returns:
+        bool: 密码是否正确
+    """
+    password_bytes = password.encode('utf-8')
+    if stored_password.startswith("pbkdf2_sha256$"):
+        _, iterations, salt_hex, digest_hex = stored_password.split('$')
+        digest = hashlib.pbkdf2_hmac('sha256', password_bytes, bytes.fromhex(salt_hex), int(iterations))
+        return hmac.compare_digest(digest.hex(), digest_hex)
+    if is_password_hash(stored_password):
+        if not HAS_BCRYPT:
+            logger.error("存储的密码为bcrypt哈希，但未安装bcrypt")
+            return False
+        return bcrypt.checkpw(password_bytes, stored_password.encode('ascii'))
+    return hmac.compare_digest(password_bytes, stored_password.encode('utf-8'))
+
+
+# 用户对象常驻内存，3.10 及以上版本使用 __slots__
+_DATACLASS_OPTIONS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_OPTIONS)
 class User:
     """统一的用户数据类"""
     user_id: str
@@ -48,7 +129,7 @@ class User:
     def __post_init__(self):
         """初始化后处理"""
         if not self.created_at:
-            self.created_at = datetime.now().isoformat()
+            self.created_at = now_iso()
     
     def to_dict(self) -> Dict:
         """将User对象转换为字典"""
@@ -83,21 +164,30 @@ class UnifiedUserManager:
         
         self.users_file = self.data_dir / "users.json"
         self.sessions_file = self.data_dir / "sessions.json"
+        # 用户修改日志（每行一条 {"op": "upsert", "user": {...}}），users.json 为上次压缩时的快照
+        self.users_log_file = self.data_dir / "users.log"
         
         self.users: Dict[str, User] = {}
         self.sessions: Dict[str, Dict] = {}
+        # 用户名 -> 用户ID 索引，登录和重名检查不再遍历全部用户
+        self._by_username: Dict[str, str] = {}
+        
+        # 认证成功缓存 {HMAC(用户名, 密码): (用户ID, 过期的单调时钟时间)}，按最近使用淘汰；
+        # 键使用进程内随机密钥的HMAC，内存中不保留明文密码
+        self._auth_cache: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._auth_cache_lock = threading.Lock()
+        self._auth_cache_secret = secrets.token_bytes(32)
         
         self._load_data()
-
-         # 初始化数据管理器功能
-        self._initialize_data_manager()   
-
-    def _initialize_data_manager(self):
-        """初始化数据管理功能"""
-        # 直接整合UserDataManager的功能到此类中
-        self.users: Dict[str, User] = {}
-        self.sessions: Dict[str, Dict] = {}
-        self._load_data()        
+        
+        # 修改用户时只追加一条日志（写入量与单个用户相关，而不是全部用户），
+        # 后台线程在日志过大时压缩；退出时将剩余日志合并进快照
+        self._save_lock = threading.Lock()
+        self._log_handle = open(self.users_log_file, 'ab', buffering=0)
+        self._dirty = threading.Event()
+        self._persist_thread = threading.Thread(target=self._persist_worker, daemon=True)
+        self._persist_thread.start()
+        atexit.register(self.flush)
 
     def create_user(self, username: str, password: str, **kwargs) -> Tuple[bool, str]:
         """创建新用户 - 修复版本"""
@@ -127,14 +217,14 @@ class UnifiedUserManager:
             user_id = f"user_{next_number:06d}"
             
             # 哈希密码
-            password = password
+            password = hash_password(password)
             
             # 创建用户对象
             user_data.update({
                 'user_id': user_id,
                 'username': username,
                 'password': password,
-                'created_at': datetime.now().isoformat(),
+                'created_at': now_iso(),
                 'last_login': None,
                 'login_count': 0,
                 'is_active': True
@@ -142,7 +232,8 @@ class UnifiedUserManager:
             
             user = User(**user_data)
             self.users[user_id] = user
-            self._save_data()
+            self._by_username[username] = user_id
+            self._append_user_log(user)
             
             return user_id
             
@@ -155,15 +246,28 @@ class UnifiedUserManager:
         try:
             # 加载用户数据
             if self.users_file.exists():
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    users_data = json.load(f)
-                    for user_id, user_data in users_data.items():
-                        self.users[user_id] = User(**user_data)
+                if HAS_IJSON:
+                    # 逐个用户流式解析，不在内存中同时保留完整的解析结果
+                    with open(self.users_file, 'rb') as f:
+                        self.users = {
+                            user_id: User(**user_data)
+                            for user_id, user_data in ijson.kvitems(f, '', use_float=True)
+                        }
+                else:
+                    with open(self.users_file, 'rb') as f:
+                        users_data = fastjson.loads(f.read())
+                    # 数据类生成的 __init__ 比逐个 setattr 的手写构造更快，直接一次推导构建
+                    self.users = {user_id: User(**user_data) for user_id, user_data in users_data.items()}
+                    del users_data
+            
+            # 回放快照之后的用户修改日志
+            self._replay_user_log()
+            self._by_username = {user.username: user_id for user_id, user in self.users.items()}
             
             # 加载会话数据
             if self.sessions_file.exists():
-                with open(self.sessions_file, 'r', encoding='utf-8') as f:
-                    self.sessions = json.load(f)
+                with open(self.sessions_file, 'rb') as f:
+                    self.sessions = fastjson.loads(f.read())
                     
             logger.info(f"Loaded {len(self.users)} users and {len(self.sessions)} sessions")
             
@@ -171,6 +275,7 @@ class UnifiedUserManager:
             logger.error(f"Error loading user data: {e}")
             self.users = {}
             self.sessions = {}
+            self._by_username = {}
 
     def _verify_password(self, input_password: str, stored_password: str) -> bool:
         """
@@ -183,21 +288,28 @@ class UnifiedUserManager:
         Returns:
             bool: 密码是否正确
         """
-        # 简单的密码验证（实际项目中应该使用哈希加密）
-        return input_password == stored_password
+        return check_password(input_password, stored_password)
     
     def authenticate(self, username: str, password: str) -> Optional[User]:
         """用户认证"""
         try:
-            user = next((u for u in self.users.values() if u.username == username), None)
+            user_id = self._by_username.get(username)
+            user = self.users.get(user_id) if user_id else None
             if not user or not user.is_active:
                 return None
             
-            if self._verify_password(password, user.password):
+            auth_token = self._auth_cache_token(username, password)
+            if self._check_auth_cache(auth_token, user.user_id) or self._verify_password(password, user.password):
+                self._remember_auth(auth_token, user.user_id)
+                
+                # 旧数据中的明文密码在首次登录成功后改为哈希，随登录信息一起写入日志
+                if not is_password_hash(user.password):
+                    user.password = hash_password(password)
+                
                 # 更新登录信息
-                user.last_login = datetime.now().isoformat()
+                user.last_login = now_iso()
                 user.login_count += 1
-                self._save_data()
+                self._append_user_log(user)
                 
                 return user
             return None
@@ -205,6 +317,63 @@ class UnifiedUserManager:
         except Exception as e:
             logger.error(f"Authentication error: {e}")
             return None
+
+    def _auth_cache_token(self, username: str, password: str) -> bytes:
+        """认证缓存键"""
+        return hmac.new(self._auth_cache_secret, f"{username}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+    
+    def _check_auth_cache(self, auth_token: bytes, user_id: str) -> bool:
+        """认证缓存是否命中且未过期"""
+        with self._auth_cache_lock:
+            cached = self._auth_cache.get(auth_token)
+            if cached is None:
+                return False
+            if cached[0] != user_id or time.monotonic() > cached[1]:
+                del self._auth_cache[auth_token]
+                return False
+            self._auth_cache.move_to_end(auth_token)
+            return True
+    
+    def _remember_auth(self, auth_token: bytes, user_id: str):
+        """记录认证成功（刷新有效期）"""
+        with self._auth_cache_lock:
+            self._auth_cache[auth_token] = (user_id, time.monotonic() + AUTH_CACHE_TTL)
+            self._auth_cache.move_to_end(auth_token)
+            if len(self._auth_cache) > AUTH_CACHE_MAX_SIZE:
+                self._auth_cache.popitem(last=False)
+    
+    def invalidate_auth_cache(self, user_id: str = None):
+        """清除认证缓存（修改密码或停用用户后调用），未指定用户时全部清除"""
+        with self._auth_cache_lock:
+            if user_id is None:
+                self._auth_cache.clear()
+            else:
+                for auth_token in [t for t, (uid, _) in self._auth_cache.items() if uid == user_id]:
+                    del self._auth_cache[auth_token]
+    
+    def verify_password(self, user_id: str, password: str) -> bool:
+        """校验指定用户的当前密码"""
+        user = self.users.get(user_id)
+        return user is not None and self._verify_password(password, user.password)
+    
+    def change_user_password(self, user_id: str, new_password: str):
+        """修改用户密码，旧密码的认证缓存随之失效"""
+        user = self.users.get(user_id)
+        if user is None:
+            raise ValueError(f"用户不存在: {user_id}")
+        
+        user.password = hash_password(new_password)
+        self.invalidate_auth_cache(user_id)
+        self._append_user_log(user)
+        logger.info(f"用户密码已修改: {user.username}")
+    
+    def reset_user_password(self, username: str, new_password: str):
+        """管理员重置用户密码"""
+        user_id = self._by_username.get(username)
+        if user_id is None:
+            raise ValueError(f"用户不存在: {username}")
+        self.change_user_password(user_id, new_password)
+
     def user_exists(self, username: str) -> bool:
         """
         检查用户名是否已存在
@@ -215,25 +384,92 @@ class UnifiedUserManager:
         Returns:
             bool: 用户名是否存在
         """
-        return any(user.username == username for user in self.users.values())   
+        return username in self._by_username
    
     
+    def _replay_user_log(self):
+        """将用户修改日志应用到已加载的用户数据"""
+        if not self.users_log_file.exists():
+            return
+        
+        replayed = 0
+        with open(self.users_log_file, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = fastjson.loads(line)
+                except ValueError:
+                    # 写入中途崩溃可能留下不完整的最后一行
+                    logger.warning(f"跳过损坏的用户日志记录: {self.users_log_file}")
+                    continue
+                if record.get("op") == "upsert":
+                    user_data = record["user"]
+                    self.users[user_data["user_id"]] = User(**user_data)
+                    replayed += 1
+        
+        if replayed:
+            logger.info(f"Replayed {replayed} user log records")
+    
+    def _append_user_log(self, user: User):
+        """追加一条用户修改日志，并通知后台线程检查是否需要压缩"""
+        line = fastjson.dumps({"op": "upsert", "user": self._user_to_dict(user)}) + b"\n"
+        with self._save_lock:
+            self._log_handle.write(line)
+        self._dirty.set()
+    
+    def _persist_worker(self):
+        """后台压缩线程：出现修改后等待一个合并窗口，日志过大时合并进快照"""
+        while True:
+            self._dirty.wait()
+            time.sleep(SAVE_FLUSH_INTERVAL)
+            self._dirty.clear()
+            try:
+                if self._log_needs_compaction():
+                    self._save_data()
+            except Exception:
+                # 压缩失败时日志仍完整保留，下次重试
+                self._dirty.set()
+    
+    def _log_needs_compaction(self) -> bool:
+        """日志是否已超过压缩阈值"""
+        log_size = self._log_handle.tell()
+        snapshot_size = self.users_file.stat().st_size if self.users_file.exists() else 0
+        return log_size > max(snapshot_size * LOG_COMPACT_RATIO, LOG_COMPACT_MIN_BYTES)
+    
+    def flush(self):
+        """将修改日志合并进快照（日志为空时不写）"""
+        if self._log_handle.tell() == 0:
+            return
+        self._save_data()
+    
     def _save_data(self):
-        """保存用户和会话数据"""
+        """保存用户和会话数据快照，并清空已合并的用户修改日志"""
         try:
-            # 保存用户数据
-            users_data = {user_id: self._user_to_dict(user) for user_id, user in self.users.items()}
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(users_data, f, ensure_ascii=False, indent=2)
-            
-            # 保存会话数据
-            with open(self.sessions_file, 'w', encoding='utf-8') as f:
-                json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+            with self._save_lock:
+                # 保存用户数据（先复制条目，避免其他线程新增用户时迭代出错）
+                users_data = {user_id: self._user_to_dict(user) for user_id, user in list(self.users.items())}
+                self._write_json_atomic(self.users_file, users_data)
+                
+                # 保存会话数据
+                self._write_json_atomic(self.sessions_file, dict(self.sessions))
+                
+                # 快照已包含全部修改
+                self._log_handle.truncate(0)
+                self._log_handle.seek(0)
                 
         except Exception as e:
             logger.error(f"Error saving data: {e}")
             raise
     
+    @staticmethod
+    def _write_json_atomic(path: Path, data: Dict):
+        """先写临时文件再替换，写入中途崩溃不会留下不完整的文件"""
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(fastjson.dumps(data))
+        os.replace(tmp_path, path)
+    
     def _user_to_dict(self, user: User) -> Dict:
         """将UserProfile对象转换为字典"""
         return {
@@ -253,8 +489,10 @@ class UnifiedUserManager:
         }
 
 
-# 单例模式实例
+# 单例模式实例：每个实例都持有日志文件句柄和后台压缩线程，进程内只能有一个，
+# 否则旧实例压缩时会用过期的用户数据截断新实例追加的日志
 _user_manager_instance = None
+_user_manager_lock = threading.Lock()
 
 def get_user_manager(data_dir: str = "data/users") -> UnifiedUserManager:
     """
@@ -268,11 +506,15 @@ def get_user_manager(data_dir: str = "data/users") -> UnifiedUserManager:
     """
     global _user_manager_instance
     if _user_manager_instance is None:
-        _user_manager_instance = UnifiedUserManager(data_dir)
+        with _user_manager_lock:
+            if _user_manager_instance is None:
+                _user_manager_instance = UnifiedUserManager(data_dir)
     return _user_manager_instance
 
 __all__ = [
     'UnifiedUserManager',
     'User',  
-    'get_user_manager'
+    'get_user_manager',
+    'hash_password',
+    'check_password'
 ]
\ No newline at end of file
@@ -1,24 +1,57 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
+import asyncio
+import hashlib
+import os
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from loguru import logger
-from threading import Thread, Event
-import queue
+from threading import Thread
 import uuid 
+from collections import Counter, deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from agents.agent_registry import AgentRegistry
+from agents.base_agent import aclose_async_clients, current_date_str
 from agents.specialty_agents import SpecialtyAgent, LogicAgent, DecisionMakersAgent
 from utils.config import ClinicalConfig
 from utils.logger import setup_logger
+from utils.timeutils import now_iso
+from utils import fastjson
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from interface.cli_interface import CLIInterface
 
+# 共享历史保留的最大消息数（每次发言2条），更早的消息自动丢弃
+SHARED_HISTORY_MAX_MESSAGES = 64
+
+# 讨论上下文包含的最近轮次数
+CONTEXT_RECENT_ROUNDS = 3
+
+# 讨论上下文中每条发言保留的最大字符数
+CONTEXT_SNIPPET_CHARS = 150
+
+# 监听线程每次等待用户输入的最长时间（秒），超时后重新检查讨论是否仍在进行
+USER_INPUT_WAIT_TIMEOUT = 0.5
+
+# 最终决策磁盘缓存保留的最大文件数和最长时间（秒），写入新缓存时清理
+SUMMARY_CACHE_MAX_FILES = 200
+SUMMARY_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# 介入选项编号 -> 介入类型（输入校验与类型分派共用，模块加载时构建一次）
+_INTERVENTION_CHOICES = {
+    '1': 'question_to_agent',
+    '2': 'broadcast_question',
+    '3': 'add_information',
+    '4': 'skip_round',
+    '5': 'interrupt'
+}
+
 class ClinicalDiscussionEngine:
     """
     临床多智能体讨论引擎
@@ -38,6 +71,9 @@ class ClinicalDiscussionEngine:
         self.current_round = 0
         self.max_rounds = getattr(args, 'discussion_rounds', 3)
         self.skip_remaining_agents = False  
+        # 讨论起止的单调时钟读数，用于计算持续时间
+        self._start_mono = time.monotonic()
+        self._end_mono = None
 
         self.discussion_config = {
             "rounds": getattr(args, 'discussion_rounds', 3),
@@ -50,15 +86,52 @@ class ClinicalDiscussionEngine:
         self.user_interventions = []
         self.medical_context = {}
         
+        # 讨论上下文缓存，记录新轮次时失效
+        self._context_cache = None
+        self._context_dirty = True
+        # 最近几轮讨论的摘要文本（每轮一段），记录轮次时只格式化新轮次并追加
+        self._recent_round_summaries = deque(maxlen=CONTEXT_RECENT_ROUNDS)
+        # 讨论质量评估缓存，讨论日志新增轮次或发言时失效
+        self._quality_cache = None
+        
+        # 各类型轮次计数和讨论内容摘录，随讨论日志增量维护
+        self._round_type_counts = Counter()
+        self._all_discussion_content = []
+        self._logic_reports = []
+        
+        # 最终决策磁盘缓存，讨论输入完全相同（如界面重放）时不再重复调用决策智能体；
+        # 与响应缓存一致，只缓存确定性调用（temperature <= 0）的决策
+        self.summary_cache_dir = Path(self.config.temp_dir) / "summaries"
+        
         # 智能体管理
         self.agent_registry = AgentRegistry()
         self.agents = {}
-        self.logic_agent = None
-        self.decision_agent = None
+        # 智能体数量和 (名称, 智能体) 元组快照，注册智能体时更新，热点路径不再反复遍历字典
+        self._agent_count = 0
+        self._agent_items = ()
+        # 逻辑检查和决策者智能体首次使用时才创建（见 logic_agent / decision_agent 属性）
+        self._logic_agent = None
+        self._decision_agent = None
+        
+        # 用户提问缓存（可选，通过 args.semantic_cache 开启），重复或相近的问题复用之前的回答
+        self.question_cache = None
+        if getattr(args, 'semantic_cache', False):
+            from utils.semantic_cache import get_semantic_cache
+            self.question_cache = get_semantic_cache(getattr(args, 'sem_threshold', 0.92))
+        
+        # 介入类型 -> 获取介入详情的处理函数（参数为当前发言的智能体）
+        self._intervention_prompts = {
+            'question_to_agent': self._prompt_question_to_agent,
+            'broadcast_question': self._prompt_broadcast_question,
+            'add_information': self._prompt_add_information,
+            'skip_round': lambda current_agent: {'type': 'skip_round'},
+            'interrupt': lambda current_agent: {'type': 'interrupt'}
+        }
         
-        # 用户交互
-        self.user_input_queue = queue.Queue()
-        self.user_intervention_event = Event()
+        # 用户交互：监听线程写入、讨论线程在轮次间读取的单生产者单消费者缓冲区
+        # deque 的 append/popleft 在 CPython 中是原子操作，无需加锁或额外的事件通知；
+        # 用户输入频率很低，不限制容量，避免未处理的输入被丢弃
+        self.user_input_queue = deque()
         
         # 初始化日志
         self.logger = setup_logger("discussion_engine")
@@ -83,78 +156,81 @@ class ClinicalDiscussionEngine:
                 "medical_record": medical_record,
                 "question": discussion_question,
                 "selected_agents": selected_agent_names,
-                "start_time": datetime.now().isoformat(),
+                "start_time": now_iso(),
                 "user_id": self.session.get('user_id', 'unknown')
             }
+            self._start_mono = time.monotonic()
+            self._end_mono = None
             
             # 初始化智能体
             self._initialize_agents(selected_agent_names)            
 
-            # 确保正确初始化逻辑检查和决策者智能体
+            # 添加共享历史记录管理（仅保留最近的消息）
+            self.shared_discussion_history = deque(maxlen=SHARED_HISTORY_MAX_MESSAGES)
+            
+            self.logger.info(f"讨论引擎初始化成功，选择了 {len(selected_agent_names)} 个智能体")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"讨论引擎初始化失败: {e}")
+            return False
+ 
+    @property
+    def logic_agent(self) -> Optional[LogicAgent]:
+        """逻辑检查智能体，首次访问时创建，创建失败返回None"""
+        if self._logic_agent is None:
             try:
-                self.logic_agent = LogicAgent(
+                self._logic_agent = LogicAgent(
                     args=self.args,
                     specialty="逻辑检查智能体",
                     agent_name="LogicAgent",
                     logger=self.logger
                 )
-                
-                self.decision_agent = DecisionMakersAgent(
+                self.logger.info("逻辑检查智能体初始化成功")
+            except Exception as e:
+                self.logger.error(f"逻辑检查智能体初始化失败: {e}")
+        return self._logic_agent
+    
+    @property
+    def decision_agent(self) -> Optional[DecisionMakersAgent]:
+        """决策者智能体，首次访问时创建，创建失败返回None（由调用方改用备用汇总）"""
+        if self._decision_agent is None:
+            try:
+                self._decision_agent = DecisionMakersAgent(
                     args=self.args,
                     specialty="决策专家智能体", 
                     agent_name="DecisionMaker",
                     logger=self.logger
                 )
-                self.logger.info("逻辑检查和决策智能体初始化成功")
+                self.logger.info("决策智能体初始化成功")
             except Exception as e:
-                self.logger.error(f"逻辑检查和决策智能体初始化失败: {e}")
-            
-            # 添加共享历史记录管理
-            self.shared_discussion_history = []
-            
-            self.logger.info(f"讨论引擎初始化成功，选择了 {len(selected_agent_names)} 个智能体")
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"讨论引擎初始化失败: {e}")
-            return False
- 
+                self.logger.error(f"决策智能体初始化失败: {e}")
+        return self._decision_agent
+    
     def _generate_final_summary(self) -> Dict[str, Any]:
         """生成最终讨论汇总 - 增强版本，包含广播问题"""
         self.logger.info("生成最终讨论汇总")
         
         try:
-            # 检查decision_agent是否已初始化
-            if self.decision_agent is None:
-                self.logger.warning("决策智能体未初始化")
-                return self._generate_backup_summary()
-            
-            # 提取所有讨论内容，包括广播问题
-            all_discussion_content = []
-            for round_data in self.discussion_log:
-                round_type = round_data.get("type", "normal")
+            # 决策者智能体生成汇总（输入相同时复用磁盘缓存的结果，不创建决策智能体）
+            cache_path = None
+            final_decision = None
+            if self.args.temp <= 0:
+                cache_path = self.summary_cache_dir / f"{self._summary_cache_key()}.json"
+                final_decision = self._load_cached_decision(cache_path)
+            if final_decision is None:
+                # 检查decision_agent是否可用
+                if self.decision_agent is None:
+                    self.logger.warning("决策智能体未初始化")
+                    return self._generate_backup_summary()
                 
-                if round_type == "broadcast_question":
-                    question = round_data.get("question", "")
-                    all_discussion_content.append(f"广播提问: {question}")
-                    
-                    for contribution in round_data.get("contributions", []):
-                        agent = contribution.get("agent", "")
-                        response = contribution.get("response", "")
-                        all_discussion_content.append(f"{agent}: {response}")
-                else:
-                    for contribution in round_data.get("contributions", []):
-                        agent = contribution.get("agent", "")
-                        analysis = contribution.get("contribution", {}).get("concise_analysis", "")
-                        if analysis:
-                            all_discussion_content.append(f"{agent}: {analysis}")
-            
-            # 决策者智能体生成汇总
-            final_decision = self.decision_agent.make_final_decision(
-                agents=self.agents,
-                discussion_log=self.discussion_log,
-                medical_context=self.medical_context
-            )
+                final_decision = self.decision_agent.make_final_decision(
+                    agents=self.agents,
+                    discussion_log=self.discussion_log,
+                    medical_context=self.medical_context
+                )
+                if cache_path is not None:
+                    self._save_cached_decision(cache_path, final_decision)
             
             # 确保final_decision是字典类型
             if isinstance(final_decision, str):
@@ -170,12 +246,12 @@ class ClinicalDiscussionEngine:
                 "discussion_log": self.discussion_log,
                 "user_interventions": self.user_interventions,
                 "metadata": {
-                    "total_rounds": len([r for r in self.discussion_log if r.get("type") == "normal"]),
-                    "broadcast_rounds": len([r for r in self.discussion_log if r.get("type") == "broadcast_question"]),
-                    "intervention_rounds": len([r for r in self.discussion_log if r.get("type") == "intervention"]),
-                    "total_agents": len(self.agents),
+                    "total_rounds": self._round_type_counts["normal"],
+                    "broadcast_rounds": self._round_type_counts["broadcast_question"],
+                    "intervention_rounds": self._round_type_counts["intervention"],
+                    "total_agents": self._agent_count,
                     "duration": self._calculate_duration(),
-                    "generated_at": datetime.now().isoformat()
+                    "generated_at": now_iso()
                 }
             }
             
@@ -185,6 +261,68 @@ class ClinicalDiscussionEngine:
             self.logger.error(f"生成最终汇总失败: {e}")
             return self._generate_backup_summary()
 
+    def _summary_cache_key(self) -> str:
+        """最终决策缓存键：模型、温度、日期、病历、讨论问题及各智能体有效发言的哈希"""
+        payload = {
+            "model": getattr(self.args, 'llm_name', ''),
+            "temperature": self.args.temp,
+            "date": current_date_str(),
+            "record": self.medical_context.get("medical_record", ""),
+            "question": self.medical_context.get("question", ""),
+            "analyses": [
+                [contribution["agent"], contribution["contribution"].get("concise_analysis", "")]
+                for round_data in self.discussion_log
+                for contribution in round_data.get("contributions", [])
+                if "contribution" in contribution and contribution["contribution"].get("success")
+            ]
+        }
+        return hashlib.sha256(fastjson.dumps(payload, sort_keys=True)).hexdigest()
+    
+    def _load_cached_decision(self, cache_path: Path) -> Optional[Dict[str, Any]]:
+        """读取缓存的最终决策，不存在或读取失败返回None"""
+        try:
+            with open(cache_path, 'rb') as f:
+                decision = fastjson.loads(f.read())
+            self.logger.info(f"复用缓存的最终决策: {cache_path.name}")
+            return decision
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warning(f"读取最终决策缓存失败: {e}")
+            return None
+    
+    def _save_cached_decision(self, cache_path: Path, decision: Any) -> None:
+        """缓存成功生成的最终决策（先写临时文件再替换）"""
+        if not isinstance(decision, dict) or not decision.get("success"):
+            return
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(fastjson.dumps(decision))
+            os.replace(tmp_path, cache_path)
+            self._prune_summary_cache()
+        except Exception as e:
+            self.logger.warning(f"写入最终决策缓存失败: {e}")
+    
+    def _prune_summary_cache(self) -> None:
+        """删除过期的最终决策缓存，并只保留最近的 SUMMARY_CACHE_MAX_FILES 个"""
+        entries = []
+        for path in self.summary_cache_dir.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        entries.sort(reverse=True)
+        
+        expire_before = time.time() - SUMMARY_CACHE_MAX_AGE
+        for index, (mtime, path) in enumerate(entries):
+            if index >= SUMMARY_CACHE_MAX_FILES or mtime < expire_before:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
     def _generate_backup_summary(self) -> Dict[str, Any]:
         """备用汇总方法，当决策智能体不可用时使用"""
         self.logger.info("使用备用汇总方法")
@@ -201,9 +339,9 @@ class ClinicalDiscussionEngine:
                     })
         
         # 生成简单总结
-        summary_text = "多专科讨论汇总：\n"
-        for contrib in all_contributions:
-            summary_text += f"{contrib['agent']}: {contrib['analysis']}\n"
+        summary_parts = ["多专科讨论汇总：\n"]
+        summary_parts.extend(f"{contrib['agent']}: {contrib['analysis']}\n" for contrib in all_contributions)
+        summary_text = "".join(summary_parts)
         
         return {
             "status": "completed_with_backup",
@@ -216,12 +354,15 @@ class ClinicalDiscussionEngine:
     def _initialize_agents(self, agent_names: List[str]):
         """初始化选择的智能体 - 使用动态创建"""
         self.agents = {}
+        self._refresh_agent_index()
         # 只初始化选择的智能体，而不是所有可用智能体
         available_agents = self.agent_registry.get_available_agents(
             self.session.get('session_id')
         )
         
         for agent_name in agent_names:
+            # 驻留智能体名称，各轮发言记录共用同一字符串对象
+            agent_name = sys.intern(agent_name)
             if agent_name in available_agents:
                 # 动态创建专科智能体
                 agent = self.agent_registry.create_specialty_agent(
@@ -230,11 +371,15 @@ class ClinicalDiscussionEngine:
                     agent_name=agent_name,
                     logger=self.logger 
                 )
-                self.agents[agent_name] = agent
+                self._register_agent(agent_name, agent)
                 self.logger.debug(f"智能体 {agent_name} 初始化成功")
             else:
                 self.logger.warning(f"智能体 {agent_name} 不存在，跳过初始化")
         
+        # 各智能体共用同一后端的连接池，由首个智能体在后台预热，首轮请求无需再建立连接
+        if self._agent_items:
+            Thread(target=self._agent_items[0][1].warm_up_connections, daemon=True).start()
+        
         self.logger.info(f"成功初始化 {len(agent_names)} 个智能体（共选择 {len(agent_names)} 个）")
     
     def add_agent_dynamically(self, specialty: str):
@@ -245,12 +390,22 @@ class ClinicalDiscussionEngine:
                 specialty=specialty,
                 logger=self.discussion_log
             )
-            self.agents[specialty] = agent
+            self._register_agent(specialty, agent)
             self.logger.info(f"动态添加专科智能体: {specialty}")
             return True
         except Exception as e:
             self.logger.error(f"动态添加智能体失败 {specialty}: {e}")
             return False
+    
+    def _register_agent(self, agent_name: str, agent: SpecialtyAgent) -> None:
+        """注册智能体并更新智能体数量和快照"""
+        self.agents[agent_name] = agent
+        self._refresh_agent_index()
+    
+    def _refresh_agent_index(self) -> None:
+        """根据当前智能体字典重建智能体数量和 (名称, 智能体) 快照"""
+        self._agent_count = len(self.agents)
+        self._agent_items = tuple(self.agents.items())
 
     def start_discussion(self) -> Dict[str, Any]:
         """开始讨论 - 确保返回完整的数据结构"""
@@ -259,6 +414,13 @@ class ClinicalDiscussionEngine:
         
         self.logger.info("开始多智能体临床讨论")
         
+        # 启用用户参与时，后台监听用户输入，轮次间统一处理
+        if self.discussion_config.get('user_participation', False):
+            Thread(target=self._user_input_listener, daemon=True).start()
+        
+        # 各并发轮次共用一个事件循环（异步客户端的连接绑定在事件循环上，不能跨循环复用），讨论结束时关闭
+        loop = None
+        
         try:
             # 执行多轮讨论
             for round_num in range(1, self.max_rounds + 1):
@@ -269,13 +431,20 @@ class ClinicalDiscussionEngine:
                 
                 self.logger.info(f"开始第 {round_num} 轮讨论")
                 
-                # 执行单轮讨论
-                round_result = self._execute_discussion_round(round_num)
-                self.discussion_log.append(round_result)
+                # 执行单轮讨论：需逐条介入时依次发言，否则各智能体并发分析
+                if self.discussion_config.get('user_participation', False):
+                    round_result = self._execute_discussion_round(round_num)
+                else:
+                    if loop is None:
+                        loop = asyncio.new_event_loop()
+                    round_result = loop.run_until_complete(self._execute_discussion_round_async(round_num))
+                self._append_round_log(round_result)
                 
-                # 检查用户是否要介入
-                if self._check_user_intervention():
-                    self._handle_user_intervention()
+                # 处理监听线程缓冲的用户介入
+                user_input = self._pop_user_input()
+                while user_input is not None and self.is_running:
+                    self._process_single_intervention(user_input)
+                    user_input = self._pop_user_input()
                 
                 # 轮次间延迟
                 time.sleep(1)
@@ -283,25 +452,29 @@ class ClinicalDiscussionEngine:
             # 生成最终汇总
             if self.is_running:
                 final_summary = self._generate_final_summary()
-                self.medical_context["end_time"] = datetime.now().isoformat()
+                finished_at = datetime.now()
+                self._end_mono = time.monotonic()
+                self.medical_context["end_time"] = finished_at.isoformat(timespec='seconds')
                 self.medical_context["status"] = "completed"
                 
                 # === 修复：构建完整的讨论结果数据 ===
+                medical_record = self.medical_context.get("medical_record", "")
+                question = self.medical_context.get("question", "")
                 complete_result = {
                     "metadata": {
                         "discussion_id": str(uuid.uuid4())[:8],
                         "user_id": self.medical_context.get("user_id", "unknown"),
-                        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
-                        "created_at": datetime.now().isoformat(),
+                        "timestamp": finished_at.strftime("%Y%m%d_%H%M%S"),
+                        "created_at": self.medical_context["end_time"],
                         "agents_used": self.medical_context.get("selected_agents", []),
                         "rounds": self.current_round,
-                        "medical_record_length": len(self.medical_context.get("medical_record", "")),
-                        "question_length": len(self.medical_context.get("question", "")),
+                        "medical_record_length": len(medical_record),
+                        "question_length": len(question),
                         "rounds_completed": self.current_round
                     },
                     "medical_context": {
-                        "medical_record": self.medical_context.get("medical_record", ""),
-                        "question": self.medical_context.get("question", ""),
+                        "medical_record": medical_record,
+                        "question": question,
                         "user_additional_info": self.medical_context.get("user_additional_info", "")
                     },
                     "discussion_process": {
@@ -323,19 +496,22 @@ class ClinicalDiscussionEngine:
             return self._create_error_result(str(e))
         finally:
             self.is_running = False
+            if loop is not None:
+                self._close_event_loop(loop)
+    
+    def _close_event_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """关闭讨论使用的事件循环，关闭前释放其中的异步客户端连接"""
+        try:
+            loop.run_until_complete(aclose_async_clients())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        except Exception as e:
+            self.logger.warning(f"关闭事件循环失败: {e}")
+        finally:
+            loop.close()
 
     def _collect_logic_reports(self) -> List[Dict]:
-        """收集逻辑检查报告"""
-        logic_reports = []
-        for round_log in self.discussion_log:
-            for contribution in round_log.get("contributions", []):
-                if "logic_report" in contribution:
-                    logic_reports.append({
-                        "agent": contribution["agent"],
-                        "round": round_log["round"],
-                        "report": contribution["logic_report"]
-                    })
-        return logic_reports
+        """收集逻辑检查报告（记录轮次时已建立索引，无需遍历讨论日志）"""
+        return self._logic_reports
 
     def _create_interrupted_result(self) -> Dict[str, Any]:
         """创建被中断的讨论结果"""
@@ -360,18 +536,6 @@ class ClinicalDiscussionEngine:
             "error": error_msg
         }
     
-    def _check_user_intervention(self) -> bool:
-        """检查用户介入 - 根据配置决定是否启用"""
-        # 如果配置为无需人工介入，直接返回False
-        if hasattr(self, 'discussion_config') and not self.discussion_config.get('user_participation', False):
-            return False
-        
-        try:
-            return self.interface.has_user_input(timeout=0.1)
-        except Exception as e:
-            self.logger.error(f"检查用户介入失败: {e}")
-            return False
-
     def _check_user_intervention_after_contribution(self) -> bool:
         """检查用户是否要在发言后介入 - 立即显示选项"""
         # 如果配置为无需人工介入，直接返回False
@@ -386,9 +550,7 @@ class ClinicalDiscussionEngine:
             # 带超时的输入
             user_input = input()
             
-            if user_input and user_input.strip() in ['1', '2', '3', '4', '5']:
-                return True
-            return False
+            return user_input.strip() in _INTERVENTION_CHOICES
                     
         except Exception as e:
             self.logger.error(f"检查用户介入失败: {e}")
@@ -413,7 +575,7 @@ class ClinicalDiscussionEngine:
         """
         round_log = {
             "round": round_num,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now_iso(),
             "contributions": [],
             "logic_reports": []
         }
@@ -425,7 +587,7 @@ class ClinicalDiscussionEngine:
         current_history = self._get_current_discussion_context()
 
         # 各智能体依次发言
-        for agent_name, agent in self.agents.items():
+        for agent_name, agent in self._agent_items:
             # 检查是否要跳过剩余发言
             if self.skip_remaining_agents:
                 self.logger.info(f"跳过剩余发言: {agent_name}")
@@ -444,23 +606,7 @@ class ClinicalDiscussionEngine:
                     specific_prompt=analysis_prompt
                 )
                 
-                # 记录贡献
-                round_log["contributions"].append({
-                    "agent": agent_name,
-                    "contribution": contribution,
-                    "timestamp": datetime.now().isoformat()
-                })
-                
-                # 将本次发言添加到共享历史
-                self._add_to_shared_history(
-                    agent_name, 
-                    contribution.get("concise_analysis", "无分析结果")
-                )
-                
-                print(f"第{round_num}轮 - {agent_name} 发言:")
-                print(f"  分析: {contribution.get('concise_analysis', '')}")
-                print(f"  字数: {contribution.get('word_count', 0)}")
-                print("-" * 50)
+                self._record_contribution(round_log, round_num, agent_name, contribution)
                 
                 # === 简化的阻塞式用户介入检查 ===
                 if hasattr(self, 'discussion_config') and self.discussion_config.get('user_participation', False):
@@ -477,11 +623,95 @@ class ClinicalDiscussionEngine:
                 round_log["contributions"].append({
                     "agent": agent_name,
                     "error": str(e),
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": round_log["timestamp"]
                 })
         
         return round_log
 
+    async def _execute_discussion_round_async(self, round_num: int) -> Dict[str, Any]:
+        """
+        执行单轮讨论（异步版本）- 各智能体并发分析，按完成顺序记录发言
+        同一轮各智能体均基于轮前的讨论历史发言，互不依赖；本轮不进行逐条用户介入
+        """
+        round_log = {
+            "round": round_num,
+            "timestamp": now_iso(),
+            "contributions": [],
+            "logic_reports": []
+        }
+        
+        # 重置跳过标志
+        self.skip_remaining_agents = False
+        
+        # 获取当前讨论历史
+        current_history = self._get_current_discussion_context()
+        
+        async def _analyze(agent_name: str, agent: SpecialtyAgent):
+            try:
+                agent.set_shared_history(current_history)
+                analysis_prompt = f"""作为{agent_name}专家，请基于之前所有讨论内容进行深度分析..."""
+                contribution = await agent.aanalyze_clinical_case(
+                    {"free_text": self.medical_context["medical_record"]},
+                    discussion_history=current_history,
+                    specific_prompt=analysis_prompt
+                )
+                return agent_name, contribution, None
+            except Exception as e:
+                return agent_name, None, e
+        
+        tasks = [asyncio.ensure_future(_analyze(agent_name, agent))
+                 for agent_name, agent in self._agent_items]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                # 检查是否要跳过剩余发言
+                if self.skip_remaining_agents:
+                    self.logger.info("跳过本轮剩余发言")
+                    break
+                
+                agent_name, contribution, error = await next_done
+                if error is None:
+                    self._record_contribution(round_log, round_num, agent_name, contribution)
+                else:
+                    self.logger.error(f"智能体 {agent_name} 发言失败: {error}")
+                    round_log["contributions"].append({
+                        "agent": agent_name,
+                        "error": str(error),
+                        "timestamp": round_log["timestamp"]
+                    })
+        finally:
+            # 取消尚未完成的分析请求
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        return round_log
+
+    def _record_contribution(self, round_log: Dict[str, Any], round_num: int,
+                             agent_name: str, contribution: Dict[str, Any]) -> None:
+        """记录智能体发言到本轮日志和共享历史，并输出到控制台（发言时间沿用本轮时间戳）"""
+        # 记录贡献
+        round_log["contributions"].append({
+            "agent": agent_name,
+            "contribution": contribution,
+            "timestamp": round_log["timestamp"]
+        })
+        
+        # 将本次发言添加到共享历史
+        self._add_to_shared_history(
+            agent_name,
+            contribution.get("concise_analysis", "无分析结果")
+        )
+        
+        # 整段一次输出
+        print(
+            f"第{round_num}轮 - {agent_name} 发言:\n"
+            f"  分析: {contribution.get('concise_analysis', '')}\n"
+            f"  字数: {contribution.get('word_count', 0)}\n"
+            + "-" * 50
+        )
+
     def _get_blocking_user_intervention(self, current_agent: str = None) -> Optional[Dict]:
         """
         阻塞式获取用户介入选择
@@ -490,22 +720,34 @@ class ClinicalDiscussionEngine:
         if not hasattr(self, 'discussion_config') or not self.discussion_config.get('user_participation', False):
             return None
         
+        # 没有可用的标准输入（如无终端的后台运行）时直接继续讨论，不再提示
+        if sys.stdin is None or sys.stdin.closed:
+            return None
+        
         try:
             print("💡" * 4 + " 是否介入讨论？")
             print("选项: 1-向智能体提问, 2-向所有提问, 3-补充信息, 4-跳过轮次, 5-终止讨论, 回车键-继续 \n", end='', flush=True)
             
             while True:
+                # 讨论过程中关闭了用户参与时不再等待输入
+                if not self.discussion_config.get('user_participation', False):
+                    return None
+                
                 choice = input("请选择操作编号 (1-5) 或直接按回车继续: ").strip()
                 
                 if choice == "":
                     # 用户按回车，继续讨论
                     print("讨论继续...")
                     return None
-                elif choice in ['1', '2', '3', '4', '5']:
+                elif choice in _INTERVENTION_CHOICES:
                     return self._get_intervention_details(choice, current_agent)
                 else:
                     print("无效输入，请选择 1-5 或直接按回车")
                     
+        except EOFError:
+            # 标准输入已结束，按“继续讨论”处理
+            self.logger.debug("标准输入已关闭，跳过用户介入")
+            return None
         except Exception as e:
             self.logger.error(f"获取用户介入失败: {e}")
             return None
@@ -514,86 +756,76 @@ class ClinicalDiscussionEngine:
         """
         根据用户选择获取介入详情 - 阻塞式输入
         """
-        intervention_map = {
-            '1': 'question_to_agent',
-            '2': 'broadcast_question',
-            '3': 'add_information', 
-            '4': 'skip_round',
-            '5': 'interrupt'
-        }
-        
-        intervention_type = intervention_map.get(choice)
+        intervention_type = _INTERVENTION_CHOICES.get(choice)
         if not intervention_type:
             return None
         
         try:
-            if intervention_type == 'question_to_agent':
-                # 显示可用智能体
-                print("\n可用智能体:")
-                agents = list(self.agents.keys())
-                for i, agent in enumerate(agents, 1):
-                    print(f"{i}. {agent}")
-                
-                agent_choice = input("请选择智能体编号或名称: ").strip()
-                
-                # 解析智能体选择
-                target_agent = None
-                if agent_choice.isdigit() and 1 <= int(agent_choice) <= len(agents):
-                    target_agent = agents[int(agent_choice) - 1]
-                elif agent_choice in agents:
-                    target_agent = agent_choice
-                else:
-                    # 默认使用当前智能体
-                    target_agent = current_agent or agents[0] if agents else None
-                
-                if not target_agent:
-                    print("无效的智能体选择")
-                    return None
-                    
-                question = input("请输入您的问题: ").strip()
-                if not question:
-                    print("问题不能为空")
-                    return None
-                    
-                return {
-                    'type': intervention_type,
-                    'target_agent': target_agent,
-                    'question': question
-                }
-                
-            elif intervention_type == 'broadcast_question':
-                question = input("请输入要向所有智能体提问的问题: ").strip()
-                if not question:
-                    print("问题不能为空")
-                    return None
-                    
-                return {
-                    'type': intervention_type,
-                    'question': question
-                }
-                
-            elif intervention_type == 'add_information':
-                information = input("请输入要补充的病例信息: ").strip()
-                if not information:
-                    print("信息不能为空")
-                    return None
-                    
-                return {
-                    'type': intervention_type,
-                    'information': information
-                }
-                
-            elif intervention_type == 'skip_round':
-                return {'type': intervention_type}
-                
-            elif intervention_type == 'interrupt':
-                return {'type': intervention_type}
-                
+            return self._intervention_prompts[intervention_type](current_agent)
         except Exception as e:
             self.logger.error(f"获取介入详情失败: {e}")
         
         return None
 
+    def _prompt_question_to_agent(self, current_agent: str = None) -> Optional[Dict[str, Any]]:
+        """获取向特定智能体提问的详情"""
+        # 显示可用智能体
+        print("\n可用智能体:")
+        agents = list(self.agents.keys())
+        for i, agent in enumerate(agents, 1):
+            print(f"{i}. {agent}")
+        
+        agent_choice = input("请选择智能体编号或名称: ").strip()
+        
+        # 解析智能体选择
+        target_agent = None
+        if agent_choice.isdigit() and 1 <= int(agent_choice) <= len(agents):
+            target_agent = agents[int(agent_choice) - 1]
+        elif agent_choice in agents:
+            target_agent = agent_choice
+        else:
+            # 默认使用当前智能体
+            target_agent = current_agent or agents[0] if agents else None
+        
+        if not target_agent:
+            print("无效的智能体选择")
+            return None
+            
+        question = input("请输入您的问题: ").strip()
+        if not question:
+            print("问题不能为空")
+            return None
+            
+        return {
+            'type': 'question_to_agent',
+            'target_agent': target_agent,
+            'question': question
+        }
+
+    def _prompt_broadcast_question(self, current_agent: str = None) -> Optional[Dict[str, Any]]:
+        """获取向所有智能体提问的详情"""
+        question = input("请输入要向所有智能体提问的问题: ").strip()
+        if not question:
+            print("问题不能为空")
+            return None
+            
+        return {
+            'type': 'broadcast_question',
+            'question': question
+        }
+
+    def _prompt_add_information(self, current_agent: str = None) -> Optional[Dict[str, Any]]:
+        """获取补充病例信息的详情"""
+        information = input("请输入要补充的病例信息: ").strip()
+        if not information:
+            print("信息不能为空")
+            return None
+            
+        return {
+            'type': 'add_information',
+            'information': information
+        }
+
     def _handle_user_intervention(self, intervention_data: Dict) -> bool:
         """
         处理用户介入 - 简化版本
@@ -611,13 +843,13 @@ class ClinicalDiscussionEngine:
                 question = intervention_data.get('question')
                 
                 if target_agent and question and target_agent in self.agents:
-                    response = self.agents[target_agent].respond_to_user_question(
-                        question, 
+                    response = self._ask_agent(
+                        target_agent,
+                        question,
                         context={
                             'discussion_context': self._get_current_discussion_context(),
                             'medical_record': self.medical_context.get("medical_record", "")
-                        },
-                        concise=True
+                        }
                     )
                     
                     if response.get('success'):
@@ -639,51 +871,55 @@ class ClinicalDiscussionEngine:
                     # 创建广播轮次记录
                     broadcast_round = {
                         "round": f"broadcast_{len(self.discussion_log) + 1}",
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": now_iso(),
                         "type": "broadcast_question",
                         "question": question,
                         "contributions": []
                     }
                     
-                    # 每个智能体依次回应
-                    for agent_name, agent in self.agents.items():
-                        print(f"\n--- {agent_name} 正在回应 ---")
-                        
-                        response = agent.respond_to_user_question(
-                            question,
-                            context={
-                                'discussion_context': self._get_current_discussion_context(),
-                                'medical_record': self.medical_context.get("medical_record", "")
-                            },
-                            concise=True
-                        )
-                        
-                        if response.get('success'):
-                            response_text = response.get('response', '')
-                            print(f"{agent_name}: {response_text}")
-                            
-                            # 记录到广播轮次
-                            broadcast_round["contributions"].append({
-                                "agent": agent_name,
-                                "response": response_text,
-                                "timestamp": datetime.now().isoformat()
-                            })
+                    # 各智能体同时回应（基于同一讨论背景），按完成顺序输出和记录
+                    context = {
+                        'discussion_context': self._get_current_discussion_context(),
+                        'medical_record': self.medical_context.get("medical_record", "")
+                    }
+                    with ThreadPoolExecutor(max_workers=max(4, self._agent_count)) as executor:
+                        futures = {
+                            executor.submit(self._ask_agent, agent_name, question, context): agent_name
+                            for agent_name in self.agents
+                        }
+                        for future in as_completed(futures):
+                            agent_name = futures[future]
+                            try:
+                                response = future.result()
+                            except Exception as e:
+                                response = {'success': False, 'error': str(e)}
                             
-                            # 添加到共享历史，让后续智能体能看到前面的回应
-                            self._add_to_shared_history(
-                                agent_name, 
-                                f"对广播问题的回应: {response_text[:200]}..."
-                            )
-                        else:
-                            print(f"{agent_name}: 回答失败")
-                            broadcast_round["contributions"].append({
-                                "agent": agent_name,
-                                "error": response.get('error', '未知错误'),
-                                "timestamp": datetime.now().isoformat()
-                            })
+                            if response.get('success'):
+                                response_text = response.get('response', '')
+                                print(f"\n--- {agent_name} 的回应 ---\n{agent_name}: {response_text}")
+                                
+                                # 记录到广播轮次
+                                broadcast_round["contributions"].append({
+                                    "agent": agent_name,
+                                    "response": response_text,
+                                    "timestamp": broadcast_round["timestamp"]
+                                })
+                                
+                                # 添加到共享历史，供后续轮次的智能体参考
+                                self._add_to_shared_history(
+                                    agent_name, 
+                                    f"对广播问题的回应: {response_text[:200]}..."
+                                )
+                            else:
+                                print(f"\n--- {agent_name} 的回应 ---\n{agent_name}: 回答失败")
+                                broadcast_round["contributions"].append({
+                                    "agent": agent_name,
+                                    "error": response.get('error', '未知错误'),
+                                    "timestamp": broadcast_round["timestamp"]
+                                })
                     
                     # 将广播轮次添加到讨论日志
-                    self.discussion_log.append(broadcast_round)
+                    self._append_round_log(broadcast_round)
                     print("\n" + "=" * 60)
                     print("所有智能体回应完成")
                     
@@ -692,7 +928,7 @@ class ClinicalDiscussionEngine:
                 if information:
                     self._update_medical_context(information)
                     # 修复：确保所有智能体都有update_context方法
-                    for agent in self.agents.values():
+                    for _, agent in self._agent_items:
                         if hasattr(agent, 'update_context'):
                             agent.update_context(information)
                         else:
@@ -714,7 +950,7 @@ class ClinicalDiscussionEngine:
             # 记录用户介入
             intervention_record = {
                 "type": intervention_type,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso(),
                 "data": intervention_data
             }
             self.user_interventions.append(intervention_record)
@@ -726,17 +962,46 @@ class ClinicalDiscussionEngine:
         
         return False
 
+    def _ask_agent(self, agent_name: str, question: str, context: Dict) -> Dict[str, Any]:
+        """
+        向智能体提问（简洁模式）
+        启用提问缓存时按 (智能体, 病例内容, 讨论上下文) 隔离，完全相同或语义相近的问题直接返回缓存的回答；
+        与语义缓存一致，只缓存确定性调用（temperature <= 0）的回答
+        """
+        agent = self.agents[agent_name]
+        if self.question_cache is None or agent.args.temp > 0:
+            return agent.respond_to_user_question(question, context=context, concise=True)
+        
+        namespace = f"question:{agent_name}:{self._question_context_digest(context)}"
+        cached = self.question_cache.get(question, namespace=namespace)
+        if cached is not None:
+            self.logger.debug(f"提问缓存命中: {agent_name}")
+            return {"success": True, "response": cached, "agent_name": agent_name, "cached": True}
+        
+        response = agent.respond_to_user_question(question, context=context, concise=True)
+        if response.get('success'):
+            self.question_cache.put(question, response.get('response', ''), namespace=namespace)
+        return response
+    
+    def _question_context_digest(self, context: Dict) -> str:
+        """提问上下文摘要（病历、补充信息及讨论上下文），病例信息变更或讨论推进后提问缓存自然失效"""
+        digest = hashlib.sha1(self.medical_context.get("medical_record", "").encode('utf-8'))
+        for item in self.medical_context.get("additional_info", []):
+            digest.update(item["info"].encode('utf-8'))
+        digest.update(fastjson.dumps(context.get("discussion_context") or [], sort_keys=True))
+        return digest.hexdigest()[:16]
+
     def _record_intervention_response(self, intervention_type: str, agent_name: str, response: Dict):
         """记录介入响应到讨论日志"""
         # 查找最近的轮次，如果没有则创建新的介入轮次
         if not self.discussion_log or self.discussion_log[-1].get("type") != "intervention":
             intervention_round = {
                 "round": f"intervention_{len(self.discussion_log) + 1}",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso(),
                 "type": "intervention",
                 "contributions": []
             }
-            self.discussion_log.append(intervention_round)
+            self._append_round_log(intervention_round)
         else:
             intervention_round = self.discussion_log[-1]
         
@@ -745,52 +1010,97 @@ class ClinicalDiscussionEngine:
             "intervention_type": intervention_type,
             "agent": agent_name,
             "response": response.get('response', ''),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         })
+        self._quality_cache = None
 
-    def _get_current_discussion_context(self) -> List[Dict]:
-        """获取当前讨论的上下文 - 增强版本，包含广播问题"""
-        context_messages = []
+    def _append_round_log(self, round_data: Dict[str, Any]) -> None:
+        """添加轮次记录到讨论日志，同时更新轮次计数和讨论内容摘录"""
+        self.discussion_log.append(round_data)
+        self._recent_round_summaries.append(self._format_round_context(round_data))
+        self._context_dirty = True
+        self._quality_cache = None
         
-        # 添加最近几轮讨论的摘要作为系统消息
-        recent_rounds = self.discussion_log[-3:]  # 最近3轮
-        context_text = []
+        round_type = round_data.get("type", "normal")
+        self._round_type_counts[round_type] += 1
         
-        for round_data in recent_rounds:
-            round_type = round_data.get("type", "normal")
-            
-            if round_type == "normal":
-                round_num = round_data.get("round", 0)
-                context_text.append(f"第{round_num + 1}轮讨论:")
-            elif round_type == "broadcast_question":
-                context_text.append("广播提问轮次:")
-            elif round_type == "intervention":
-                context_text.append("用户介入轮次:")
-            
+        # 索引本轮发言附带的逻辑检查报告
+        for contribution in round_data.get("contributions", []):
+            if "logic_report" in contribution:
+                self._logic_reports.append({
+                    "agent": contribution["agent"],
+                    "round": round_data["round"],
+                    "report": contribution["logic_report"]
+                })
+        
+        # 提取讨论内容，包括广播问题
+        if round_type == "broadcast_question":
+            self._all_discussion_content.append(f"广播提问: {round_data.get('question', '')}")
             for contribution in round_data.get("contributions", []):
-                agent = contribution.get("agent", "")
-                
-                if round_type == "broadcast_question":
-                    response = contribution.get("response", "")
-                    if response:
-                        short_response = response[:150] + "..." if len(response) > 150 else response
-                        context_text.append(f"  {agent}: {short_response}")
-                else:
-                    analysis = contribution.get("contribution", {}).get("concise_analysis", "")
-                    if analysis:
-                        short_analysis = analysis[:150] + "..." if len(analysis) > 150 else analysis
-                        context_text.append(f"  {agent}: {short_analysis}")
+                self._all_discussion_content.append(
+                    f"{contribution.get('agent', '')}: {contribution.get('response', '')}"
+                )
+        else:
+            for contribution in round_data.get("contributions", []):
+                analysis = contribution.get("contribution", {}).get("concise_analysis", "")
+                if analysis:
+                    self._all_discussion_content.append(f"{contribution.get('agent', '')}: {analysis}")
+
+    def _get_current_discussion_context(self) -> List[Dict]:
+        """获取当前讨论的上下文 - 增强版本，包含广播问题（结果缓存至讨论日志变更）"""
+        if not self._context_dirty:
+            return self._context_cache
+        
+        self._context_cache = self._build_discussion_context()
+        self._context_dirty = False
+        return self._context_cache
+    
+    def _build_discussion_context(self) -> List[Dict]:
+        """根据最近几轮讨论的摘要行构建上下文消息"""
+        context_messages = []
+        
+        # 添加最近几轮讨论的摘要作为系统消息（各轮摘要在记录轮次时已生成，这里只拼接）
+        context_text = "\n".join(summary for summary in self._recent_round_summaries if summary)
         
         # 将摘要转换为消息格式
         if context_text:
             context_messages.append({
                 "role": "system", 
-                "content": "之前的讨论摘要:\n" + "\n".join(context_text)
+                "content": "之前的讨论摘要:\n" + context_text
             })
         
         return context_messages if context_messages else [
             {"role": "system", "content": "这是第一轮讨论，暂无历史记录"}
         ]
+    
+    def _format_round_context(self, round_data: Dict[str, Any]) -> str:
+        """生成单轮讨论的摘要文本（介入轮次只记录标题，后续追加的介入响应不影响摘要）"""
+        round_type = round_data.get("type", "normal")
+        context_text = []
+        
+        if round_type == "normal":
+            round_num = round_data.get("round", 0)
+            context_text.append(f"第{round_num + 1}轮讨论:")
+        elif round_type == "broadcast_question":
+            context_text.append("广播提问轮次:")
+        elif round_type == "intervention":
+            context_text.append("用户介入轮次:")
+        
+        is_broadcast = round_type == "broadcast_question"
+        for contribution in round_data.get("contributions", []):
+            if is_broadcast:
+                text = contribution.get("response", "")
+            else:
+                text = contribution.get("contribution", {}).get("concise_analysis", "")
+            if not text:
+                continue
+            
+            # 每条发言只在记录轮次时截断一次，超长时切片与省略号一次拼接
+            if len(text) > CONTEXT_SNIPPET_CHARS:
+                text = f"{text[:CONTEXT_SNIPPET_CHARS]}..."
+            context_text.append(f"  {contribution.get('agent', '')}: {text}")
+        
+        return "\n".join(context_text)
 
     def _add_to_shared_history(self, agent_name: str, content: str) -> None:
         """添加发言到共享历史"""
@@ -801,27 +1111,40 @@ class ClinicalDiscussionEngine:
         ])
     
     def _user_input_listener(self):
-        """监听用户输入"""
+        """监听用户输入（阻塞等待输入，空闲时线程挂起而不是空转）"""
         while self.is_running:
             try:
-                # 非阻塞获取用户输入
+                wait_started = time.monotonic()
+                if not self.interface.has_user_input(timeout=USER_INPUT_WAIT_TIMEOUT):
+                    # 接口不支持阻塞等待时会立即返回，补足剩余的等待时间
+                    remaining = USER_INPUT_WAIT_TIMEOUT - (time.monotonic() - wait_started)
+                    if remaining > 0:
+                        time.sleep(remaining)
+                    continue
+                
                 user_input = self.interface.get_user_input()
-                if user_input:
-                    self.user_input_queue.put(user_input)
-                    self.user_intervention_event.set()
-            except queue.Empty:
-                continue
+                if isinstance(user_input, dict):
+                    self.user_input_queue.append(user_input)
+                elif user_input:
+                    self.logger.warning(f"忽略无法识别的用户输入: {user_input!r}")
             except Exception as e:
                 self.logger.error(f"用户输入监听错误: {e}")
                 break
  
+    def _pop_user_input(self) -> Optional[Dict[str, Any]]:
+        """取出最早的未处理用户输入，没有时返回None"""
+        try:
+            return self.user_input_queue.popleft()
+        except IndexError:
+            return None
+
     def _process_single_intervention(self, user_input: Dict[str, Any]):
         """处理单个用户介入请求"""
         intervention_type = user_input.get('type', 'broadcast')
         
         intervention_record = {
             "type": intervention_type,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now_iso(),
             "user_input": user_input
         }
         
@@ -831,8 +1154,9 @@ class ClinicalDiscussionEngine:
                 target_agent = user_input.get('target_agent')
                 question = user_input.get('question')
                 
-                if target_agent in self.agents:
-                    response = self.agents[target_agent].respond_to_user_question(question)
+                agent = self.agents.get(target_agent)
+                if agent is not None:
+                    response = agent.respond_to_user_question(question)
                     intervention_record["response"] = response
                     intervention_record["target_agent"] = target_agent
                 else:
@@ -841,12 +1165,7 @@ class ClinicalDiscussionEngine:
             elif intervention_type == 'broadcast_question':
                 # 用户向所有智能体广播问题
                 question = user_input.get('question')
-                responses = {}
-                
-                for agent_name, agent in self.agents.items():
-                    responses[agent_name] = agent.respond_to_user_question(question)
-                
-                intervention_record["responses"] = responses
+                intervention_record["responses"] = self._broadcast_question(question)
                 
             elif intervention_type == 'add_information':
                 # 用户补充信息
@@ -874,57 +1193,60 @@ class ClinicalDiscussionEngine:
         
         self.medical_context["additional_info"].append({
             "info": new_information,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         })
         
         # 通知所有智能体更新上下文
-        for agent in self.agents.values():
+        for _, agent in self._agent_items:
             agent.update_context(new_information)
   
     def _assess_discussion_quality(self) -> Dict[str, Any]:
-        """评估讨论质量"""
+        """评估讨论质量（讨论日志未变更时直接返回上次的评估结果）"""
+        if self._quality_cache is not None:
+            return dict(self._quality_cache)
+        
         try:
-            # 分析讨论深度和广度
-            total_contributions = sum(len(round["contributions"]) for round in self.discussion_log)
-            unique_perspectives = len(set(
-                cont["agent"] for round in self.discussion_log 
-                for cont in round["contributions"] 
-                if "agent" in cont
-            ))
-            
-            # 评估逻辑一致性
-            logic_issues = sum(
-                1 for round in self.discussion_log 
-                for report in round.get("logic_reports", [])
-                if report.get("logic_report", {}).get("has_issues", False)
-            )
+            # 单次遍历讨论日志，同时统计讨论深度和广度、提及的诊断及逻辑问题
+            total_contributions = 0
+            perspectives = set()
+            diagnoses_mentioned = set()
+            logic_issues = 0
+            for round_data in self.discussion_log:
+                contributions = round_data["contributions"]
+                total_contributions += len(contributions)
+                for cont in contributions:
+                    if "agent" in cont:
+                        perspectives.add(cont["agent"])
+                    analysis = cont.get("contribution", {})
+                    if "diagnosis" in analysis:
+                        diagnoses_mentioned.add(analysis["diagnosis"])
+                
+                # 评估逻辑一致性
+                for report in round_data.get("logic_reports", []):
+                    if report.get("logic_report", {}).get("has_issues", False):
+                        logic_issues += 1
             
             quality_scores = {
-                "diagnosis_completeness": self._score_diagnosis_completeness(),
+                "diagnosis_completeness": self._score_diagnosis_completeness(diagnoses_mentioned),
                 "treatment_rationality": self._score_treatment_rationality(),
                 "integration_quality": self._score_integration_quality(),
-                "discussion_depth": min(10, total_contributions // len(self.agents)),
-                "perspective_diversity": min(10, unique_perspectives * 2),
+                "discussion_depth": min(10, total_contributions // self._agent_count),
+                "perspective_diversity": min(10, len(perspectives) * 2),
                 "logic_consistency": max(0, 10 - logic_issues)
             }
             
             quality_scores["overall_score"] = sum(quality_scores.values()) / len(quality_scores)
             
-            return quality_scores
+            self._quality_cache = quality_scores
+            return dict(quality_scores)
             
         except Exception as e:
             self.logger.error(f"质量评估失败: {e}")
             return {"overall_score": 0, "error": str(e)}
     
-    def _score_diagnosis_completeness(self) -> int:
+    def _score_diagnosis_completeness(self, diagnoses_mentioned: set) -> int:
         """评估诊断全面性"""
         # 基于讨论中提到的诊断数量和差异性评分
-        diagnoses_mentioned = set()
-        for round in self.discussion_log:
-            for cont in round["contributions"]:
-                if "diagnosis" in cont.get("contribution", {}):
-                    diagnoses_mentioned.add(cont["contribution"]["diagnosis"])
-        
         return min(10, len(diagnoses_mentioned))
     
     def _score_treatment_rationality(self) -> int:
@@ -938,11 +1260,9 @@ class ClinicalDiscussionEngine:
         return 7  # 简化实现
     
     def _calculate_duration(self) -> str:
-        """计算讨论持续时间"""
-        start_time = datetime.fromisoformat(self.medical_context["start_time"])
-        end_time = datetime.fromisoformat(self.medical_context.get("end_time", datetime.now().isoformat()))
-        duration = end_time - start_time
-        return str(duration)
+        """计算讨论持续时间（基于单调时钟，不解析时间字符串，也不受系统时间调整影响）"""
+        end_mono = self._end_mono if self._end_mono is not None else time.monotonic()
+        return str(timedelta(seconds=end_mono - self._start_mono))
     
     def stop_discussion(self):
         """停止讨论"""
@@ -971,9 +1291,10 @@ class ClinicalDiscussionEngine:
             响应结果字典
         """
         try:
-            if target_agent and target_agent in self.agents:
+            agent = self.agents.get(target_agent) if target_agent else None
+            if agent is not None:
                 # 向特定智能体提问
-                response = self.agents[target_agent].respond_to_user_question(
+                response = agent.respond_to_user_question(
                     question, 
                     context=self.medical_context
                 )
@@ -984,16 +1305,9 @@ class ClinicalDiscussionEngine:
                 }
             else:
                 # 向所有智能体广播
-                responses = {}
-                for agent_name, agent in self.agents.items():
-                    responses[agent_name] = agent.respond_to_user_question(
-                        question, 
-                        context=self.medical_context
-                    )
-                
                 return {
                     "success": True,
-                    "responses": responses,
+                    "responses": self._broadcast_question(question, context=self.medical_context),
                     "type": "broadcast"
                 }
                 
@@ -1002,4 +1316,16 @@ class ClinicalDiscussionEngine:
             return {
                 "success": False,
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+    
+    def _broadcast_question(self, question: str, context: Dict = None) -> Dict[str, Dict[str, Any]]:
+        """在线程池中向所有智能体同时提问，按智能体顺序返回 {智能体名称: 响应}"""
+        if not self._agent_count:
+            return {}
+        
+        with ThreadPoolExecutor(max_workers=self._agent_count) as executor:
+            futures = {
+                agent_name: executor.submit(agent.respond_to_user_question, question, context=context)
+                for agent_name, agent in self._agent_items
+            }
+        return {agent_name: future.result() for agent_name, future in futures.items()}
\ No newline at end of file
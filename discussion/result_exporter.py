@@ -2,7 +2,6 @@
 结果导出模块 - 负责将多智能体讨论结果导出为多种格式
 """
 
-import json
 import os
 from datetime import datetime
 from pathlib import Path
@@ -10,6 +9,8 @@ from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 from loguru import logger
 
+from utils import fastjson
+
 try:
     from docx import Document
     from docx.shared import Inches, Pt
@@ -88,9 +89,8 @@ class ClinicalResultExporter:
         filename = self.generate_export_filename(username, "json")
         filepath = self.json_dir / filename
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2, 
-                     default=self._json_serializer)
+        with open(filepath, 'wb') as f:
+            f.write(fastjson.dumps(export_data, indent=True, default=self._json_serializer))
         
         logger.info(f"JSON导出完成: {filepath}")
         return str(filepath)
@@ -15,7 +15,7 @@ def create_default_model_config():
             "api_base": "http://10.124.0.7:9001/v1",
             "model_name": "Qwen3-next",
             "temperature": 0.3,
-            "max_tokens": 100000,
+            "max_tokens": 2048,
             "timeout": 60,
             "max_retries": 3
         },
@@ -12,7 +12,7 @@ from dataclasses import dataclass, field
 import uuid
 
 # 导入自定义模块
-from auth.user_manager import UnifiedUserManager
+from auth.user_manager import get_user_manager
 from auth.session_handler import SessionHandler
 from agents.agent_registry import AgentRegistry
 from discussion.discussion_engine import ClinicalDiscussionEngine
@@ -38,7 +38,7 @@ class ClinicalCLI:
         
         # 初始化核心组件
         try:
-            self.user_manager = UnifiedUserManager()
+            self.user_manager = get_user_manager()
             self.session_handler = SessionHandler()
             self.agent_registry = AgentRegistry()
             self.discussion_storage = DiscussionStorage()
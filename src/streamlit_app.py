@@ -1,5 +1,4 @@
 import streamlit as st
-import json
 import pandas as pd
 from datetime import datetime
 import os
@@ -12,19 +11,20 @@ import plotly.graph_objects as go
 import plotly.express as px
 
 # 导入项目模块
-from auth.user_manager import UnifiedUserManager
+from auth.user_manager import get_user_manager
 from auth.session_handler import SessionHandler
 from agents.agent_registry import AgentRegistry
 from discussion.discussion_engine import ClinicalDiscussionEngine
 from storage.discussion_storage import DiscussionStorage
 from utils.config import ClinicalConfig
 from utils.logger import setup_logger
+from utils import fastjson
 
 class ClinicalWebInterface:
     def __init__(self):
         self.setup_page_config()
         self.initialize_session_state()
-        self.user_manager = UnifiedUserManager()
+        self.user_manager = get_user_manager()
         self.session_handler = SessionHandler()
         self.agent_registry = AgentRegistry()
         self.discussion_storage = DiscussionStorage()
@@ -745,8 +745,7 @@ class ClinicalWebInterface:
         }
         
         # 提供JSON下载
-        json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
-        b64 = base64.b64encode(json_str.encode()).decode()
+        b64 = base64.b64encode(fastjson.dumps(export_data, indent=True)).decode()
         href = f'<a href="data:application/json;base64,{b64}" download="clinical_discussion_{datetime.now().strftime("%Y%m%d_%H%M")}.json">下载JSON数据</a>'
         st.markdown(href, unsafe_allow_html=True)
 
@@ -1,4 +1,3 @@
-import json
 import os
 import uuid
 from datetime import datetime
@@ -10,6 +9,8 @@ from docx import Document
 from docx.shared import Inches
 import html
 
+from utils import fastjson
+
 class DiscussionStorage:
     """讨论记录存储和管理类"""
     
@@ -40,8 +41,8 @@ class DiscussionStorage:
             
             for filepath in json_dir.glob(pattern):
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        discussion_data = json.load(f)
+                    with open(filepath, 'rb') as f:
+                        discussion_data = fastjson.loads(f.read())
                         discussions.append({
                             "filepath": str(filepath),
                             "metadata": discussion_data["metadata"],
@@ -458,8 +459,8 @@ class DiscussionStorage:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 export_path = self.storage_base / "exports" / f"discussion_{timestamp}.json"
             
-            with open(export_path, 'w', encoding='utf-8') as f:
-                json.dump(discussion_data, f, ensure_ascii=False, indent=2)
+            with open(export_path, 'wb') as f:
+                f.write(fastjson.dumps(discussion_data, indent=True))
             
             logger.info(f"JSON导出完成: {export_path}")
             return str(export_path)
@@ -733,8 +734,8 @@ class DiscussionStorage:
             }
             
             # 保存到JSON文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(discussion_record, f, ensure_ascii=False, indent=2)
+            with open(filepath, 'wb') as f:
+                f.write(fastjson.dumps(discussion_record, indent=True))
             
             logger.info(f"讨论记录已保存: {filepath}")
             return str(filepath)
@@ -753,8 +754,8 @@ class DiscussionStorage:
             json_dir = self.storage_base / "json"
             
             for filepath in json_dir.glob(pattern):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                with open(filepath, 'rb') as f:
+                    data = fastjson.loads(f.read())
                 
                 # === 修复：确保返回的数据结构完整 ===
                 return {
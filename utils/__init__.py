@@ -3,13 +3,14 @@ Utils模块 - 提供配置管理、日志记录等工具功能
 """
 
 from .config import ClinicalConfig, get_config
-from .logger import setup_logger, get_logger, log_system_start, log_system_stop
+from .logger import setup_logger, get_logger, get_agent_logger, log_system_start, log_system_stop
 
 __all__ = [
     'ClinicalConfig',
     'get_config', 
     'setup_logger',
     'get_logger',
+    'get_agent_logger',
     'log_system_start',
     'log_system_stop'
 ]
\ No newline at end of file
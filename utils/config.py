@@ -27,7 +27,7 @@ class ModelConfig:
     api_base: str = "http://10.124.0.7:9001/v1"
     model_name: str = "Qwen3-next"
     temperature: float = 0.3
-    max_tokens: int = 100000
+    max_tokens: int = 2048
     timeout: int = 60
     max_retries: int = 3,
     available_models: List[Dict] = field(default_factory=list)  # 可用模型列表
@@ -0,0 +1,47 @@
+"""
+JSON序列化工具
+优先使用orjson，未安装时回退到标准库json
+"""
+
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False,
+          default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    序列化为UTF-8字节串（中文不转义）
+
+    Args:
+        obj: 待序列化对象
+        indent: 是否使用2空格缩进
+        sort_keys: 是否按键排序（用于生成稳定的缓存键）
+        default: 不支持类型的转换函数（与标准库一致，datetime 也交由它处理）
+
+    Returns:
+        bytes: JSON字节串
+    """
+    if HAS_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None,
+                      sort_keys=sort_keys, default=default).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """反序列化JSON字节串或字符串"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
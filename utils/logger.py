@@ -6,6 +6,8 @@
 
 import os
 import sys
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, Any
 from loguru import logger
@@ -51,6 +53,19 @@ def setup_logger(name: str = None) -> Any:  # 或者直接省略 -> Logger
     
     return logger
 
+# setup_logger 会移除并重新添加全局输出，并发创建智能体时须串行配置
+_agent_logger_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _configure_agent_logger(name: str) -> Any:
+    """配置智能体日志输出（按名称缓存，须持有 _agent_logger_lock 调用）"""
+    return setup_logger(name)
+
+def get_agent_logger(name: str) -> Any:
+    """获取智能体日志记录器（同名只配置一次，避免每个智能体实例重复配置日志输出）"""
+    with _agent_logger_lock:
+        return _configure_agent_logger(name)
+
 def get_logger(name: str = None) -> Any:
     """获取日志记录器"""
     if name is None:
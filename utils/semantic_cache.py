@@ -0,0 +1,184 @@
+"""
+语义缓存模块
+基于句向量相似度复用相近提示词的模型响应，完全相同的文本先走精确匹配
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    HAS_SEMANTIC_DEPS = True
+except ImportError:
+    HAS_SEMANTIC_DEPS = False
+
+
+class SemanticCache:
+    """
+    语义缓存
+    按命名空间保存 (向量, 响应)，查询时返回余弦相似度超过阈值的最近邻响应
+    完全相同的文本由精确匹配层直接命中，无需计算向量（未安装向量模型依赖时仍可用）
+    """
+
+    def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5", threshold: float = 0.92,
+                 max_entries: int = 1024, ttl: Optional[float] = None,
+                 exact_max_entries: int = 4096):
+        """
+        初始化语义缓存
+
+        Args:
+            model_name: 句向量模型名称
+            threshold: 命中所需的最小余弦相似度
+            max_entries: 每个命名空间的最大条目数
+            ttl: 条目有效期（秒），None表示不过期
+            exact_max_entries: 精确匹配层的最大条目数（所有命名空间合计，LRU淘汰）
+        """
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.exact_max_entries = exact_max_entries
+
+        self._model = None
+        self._disabled = not HAS_SEMANTIC_DEPS
+        # namespace -> [(向量, 响应, 写入时间)]
+        self._entries: Dict[str, List[Tuple["np.ndarray", str, float]]] = {}
+        # (namespace, 文本) -> (响应, 写入时间)
+        self._exact: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 最近一次向量化结果，未命中后写入同一文本时无需重复计算
+        self._last_embedding: Optional[Tuple[str, "np.ndarray"]] = None
+
+        self.hits = 0
+        self.misses = 0
+
+        if self._disabled:
+            logger.warning("sentence-transformers 未安装，语义缓存已禁用")
+
+    def _get_model(self):
+        """延迟加载句向量模型"""
+        if self._model is None and not self._disabled:
+            try:
+                self._model = SentenceTransformer(self.model_name)
+                logger.info(f"语义缓存模型已加载: {self.model_name}")
+            except Exception as e:
+                logger.warning(f"加载语义缓存模型失败，语义缓存已禁用: {e}")
+                self._disabled = True
+        return self._model
+
+    def _embed(self, text: str) -> Optional["np.ndarray"]:
+        """计算归一化向量"""
+        last = self._last_embedding
+        if last is not None and last[0] == text:
+            return last[1]
+
+        model = self._get_model()
+        if model is None:
+            return None
+        vector = model.encode(text, normalize_embeddings=True)
+        self._last_embedding = (text, vector)
+        return vector
+
+    def _get_exact(self, text: str, namespace: str) -> Optional[str]:
+        """精确匹配查询，命中时计入命中统计"""
+        key = (namespace, text)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self._exact[key]
+                return None
+            self._exact.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, text: str, namespace: str = "default") -> Optional[str]:
+        """
+        查询完全相同或语义相近的缓存响应
+
+        Args:
+            text: 查询文本
+            namespace: 命名空间（不同智能体/系统提示词互不共享）
+
+        Returns:
+            Optional[str]: 命中的响应，未命中返回None
+        """
+        response = self._get_exact(text, namespace)
+        if response is not None:
+            return response
+
+        vector = self._embed(text)
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if self.ttl is not None and entries:
+                entries[:] = [e for e in entries if now - e[2] <= self.ttl]
+            if not entries:
+                self.misses += 1
+                return None
+
+            scores = np.stack([e[0] for e in entries]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                return entries[best][1]
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, response: str, namespace: str = "default") -> None:
+        """
+        写入缓存
+
+        Args:
+            text: 查询文本
+            response: 对应的模型响应
+            namespace: 命名空间
+        """
+        with self._lock:
+            self._exact[(namespace, text)] = (response, time.time())
+            self._exact.move_to_end((namespace, text))
+            if len(self._exact) > self.exact_max_entries:
+                self._exact.popitem(last=False)
+
+        vector = self._embed(text)
+        if vector is None:
+            return
+
+        with self._lock:
+            entries = self._entries.setdefault(namespace, [])
+            entries.append((vector, response, time.time()))
+            if len(entries) > self.max_entries:
+                del entries[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存命中统计"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": sum(len(e) for e in self._entries.values()),
+            "exact_size": len(self._exact)
+        }
+
+
+# 全局语义缓存实例，按命中阈值区分（阈值不同的调用方不共享同一实例）
+_semantic_cache_instances: Dict[float, SemanticCache] = {}
+_semantic_cache_lock = threading.Lock()
+
+def get_semantic_cache(threshold: float = 0.92) -> SemanticCache:
+    """获取指定阈值的全局语义缓存实例"""
+    with _semantic_cache_lock:
+        cache = _semantic_cache_instances.get(threshold)
+        if cache is None:
+            cache = _semantic_cache_instances[threshold] = SemanticCache(threshold=threshold)
+        return cache
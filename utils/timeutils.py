@@ -0,0 +1,19 @@
+"""
+时间格式化工具
+同一秒内复用ISO时间戳字符串，批量创建记录时不重复格式化
+"""
+
+import time
+from datetime import datetime
+from functools import lru_cache
+
+
+@lru_cache(maxsize=2)
+def _format_iso_second(second: int) -> str:
+    """格式化ISO时间戳（按秒缓存）"""
+    return datetime.fromtimestamp(second).isoformat(timespec='seconds')
+
+
+def now_iso() -> str:
+    """当前时间的ISO时间戳（精确到秒），如“2024-01-01T08:00:00”"""
+    return _format_iso_second(int(time.time()))